@@ -1,2 +1,3 @@
 from .dataset import PathAttenDataset, collect_fn
+from .sampler import BucketBatchSampler
 from .vocab import TextVocab, UniTextVocab, CTTextVocab
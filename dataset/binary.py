@@ -0,0 +1,55 @@
+import os
+import json
+import numpy as np
+
+
+def open_array(path, dtype):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+class BinaryCorpus:
+    '''
+    Reader of the <type>_bin dir written by parser/binary_utils.py, all arrays are memory-mapped,
+    so a sample is sliced from the page cache without parsing and the forked workers share one copy
+    '''
+
+    def __init__(self, bin_dir):
+        self.bin_dir = bin_dir
+        with open(os.path.join(bin_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        with open(os.path.join(bin_dir, 'tokens.json'), 'r') as f:
+            self.tokens = json.load(f)
+        self.num = meta['num']
+        self.fields = meta['fields']
+        self.data, self.offsets, self.inner = dict(), dict(), dict()
+        for field, levels in self.fields.items():
+            self.data[field] = open_array(os.path.join(bin_dir, field + '.data'), np.int32)
+            self.offsets[field] = open_array(os.path.join(bin_dir, field + '.offsets'), np.int64)
+            if levels == 2:
+                self.inner[field] = open_array(os.path.join(bin_dir, field + '.inner'), np.int64)
+
+    def __len__(self):
+        return self.num
+
+    def get_field(self, field, item):
+        '''
+        :return: a view of the memmap for level 1 fields, and a list of views for level 2 fields
+        '''
+        start, end = self.offsets[field][item], self.offsets[field][item + 1]
+        if self.fields[field] == 1:
+            return self.data[field][start:end]
+        if start == end:
+            return []
+        bounds = self.inner[field][start:end + 1]
+        return np.split(self.data[field][bounds[0]:bounds[-1]], bounds[1:-1] - bounds[0])
+
+    def get(self, item):
+        '''
+        :return: the same keys as convert_line, content and target are converted back to strings
+        '''
+        data = {field: self.get_field(field, item) for field in self.fields}
+        data['target'] = [self.tokens[idx] for idx in data['target']]
+        data['content'] = [self.tokens[idx] for idx in data['content']]
+        return data
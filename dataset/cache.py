@@ -0,0 +1,91 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+from .binary import open_array
+
+# bumped when the stored fields change
+CACHE_VERSION = 3
+# the args that change the output of PathAttenDataset.process
+CACHE_ARGS = ['max_code_length', 'max_path_num', 'max_path_length', 'max_r_path_num', 'max_r_path_length',
+              'path_embedding_num', 'max_target_len', 'hop', 'pointer', 'uni_vocab', 'sparse_path_map', 'paths_once']
+
+
+def cache_key(source_path, corpus_line, args, s_vocab, t_vocab):
+    '''
+    sha1 of the cache version, the source file (path, size, mtime), the sample num, the relevant args and the vocabs
+    '''
+    stat = os.stat(source_path)
+    key = {'version': CACHE_VERSION, 'num': corpus_line,
+           'source': [os.path.abspath(source_path), stat.st_size, stat.st_mtime_ns],
+           'args': {name: getattr(args, name) for name in CACHE_ARGS},
+           'vocab': [json.dumps(s_vocab.vocab, sort_keys=True), json.dumps(t_vocab.vocab, sort_keys=True)]}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def list_collate(batch):
+    return batch
+
+
+class SampleCache:
+    '''
+    Processed samples of PathAttenDataset, stored as one flat int32 array per field plus the shape of every sample,
+    all memory-mapped, so the epochs after the first one and every predict call only slice arrays
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        self.num = meta['num']
+        self.fields = meta['fields']
+        self.data, self.shapes, self.offsets = dict(), dict(), dict()
+        for field in self.fields:
+            self.data[field] = open_array(os.path.join(cache_dir, field + '.data'), np.int32)
+            shapes = np.load(os.path.join(cache_dir, field + '.shapes.npy'))
+            self.shapes[field] = shapes
+            self.offsets[field] = np.concatenate([[0], np.cumsum(np.prod(shapes, axis=1))]).astype(np.int64)
+
+    def __len__(self):
+        return self.num
+
+    def get(self, item):
+        sample = dict()
+        for field in self.fields:
+            start, end = self.offsets[field][item], self.offsets[field][item + 1]
+            sample[field] = self.data[field][start:end].astype(np.int64).reshape(tuple(self.shapes[field][item]))
+        for field in ['target', 'voc_len', 'index']:
+            if field in sample:
+                sample[field] = int(sample[field])
+        return sample
+
+    @staticmethod
+    def build(dataset, cache_dir, num_workers):
+        '''
+        run the samples of dataset through a DataLoader once and append every field to its file
+        '''
+        tmp_dir = cache_dir + '.tmp'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        files, shapes = dict(), dict()
+        loader = DataLoader(dataset, batch_size=64, num_workers=num_workers, collate_fn=list_collate)
+        for batch in tqdm(loader, desc='Caching {}'.format(os.path.basename(cache_dir))):
+            for sample in batch:
+                for field, value in sample.items():
+                    value = np.asarray(value)
+                    if field not in files:
+                        files[field] = open(os.path.join(tmp_dir, field + '.data'), 'wb')
+                        shapes[field] = []
+                    files[field].write(value.astype(np.int32).tobytes())
+                    shapes[field].append(value.shape)
+        for field, f in files.items():
+            f.close()
+            np.save(os.path.join(tmp_dir, field + '.shapes.npy'),
+                    np.array(shapes[field], dtype=np.int64).reshape(len(shapes[field]), -1))
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'num': len(dataset), 'fields': sorted(files)}, f)
+        os.replace(tmp_dir, cache_dir)
@@ -1,6 +1,9 @@
 from torch.utils.data import Dataset
 import os
 import torch
+import numpy as np
+from .binary import BinaryCorpus
+from .cache import SampleCache, cache_key
 from .process_utils import convert_line, decoder_process, row_process, content_process, path_process, r_path_process, \
     make_extended_vocabulary
 
@@ -17,11 +20,15 @@ class PathAttenDataset(Dataset):
     The 'content' is the code tokens, the 'content_mask' is mask for token padding
 
     The 'path_map' is the matrix M for mapping, see appendix about the efficient computation of relative path encoding for details
+    With sparse_path_map, the sample keeps only the 'path_map_coo' (row, col, path idx) triples and collect_fn builds M
     The 'r_path_idx' is used for reduce cost of absolute path, also see appendix about absolute path encoding
 
     The 'named' and 'row' are some additional structure information, but they are not much useful, so you can also ignore them
 
-    The 'e_voc', 'e_voc_', 'voc_len' and 'content_e' are used for pointer network
+    The 'voc_len' and 'content_e' are used for pointer network, the tokens out of vocab get the ids from len(vocab) on
+    in the order they appear in the content, and the 'index' of the sample is kept to decode them with extended_vocabulary
+
+    The samples are not padded, collect_fn pads every field to the longest sample of the batch
     '''
 
     def __init__(self, args, s_vocab, t_vocab, type_):
@@ -32,39 +39,74 @@ class PathAttenDataset(Dataset):
         self.args = args
         self.type_ = type_
         assert type_ in ['train', 'test', 'valid']
-        if self.on_memory:
+        if self.args.data_format == 'binary':
+            self.corpus = BinaryCorpus(os.path.join(self.dataset_dir, type_ + '_bin'))
+            self.corpus_line = len(self.corpus)
+        elif self.on_memory:
+            # one bytes buffer and an offsets array instead of a list of str, so the forked workers
+            # do not touch per line refcounts and keep sharing the same pages
             self.json_path = os.path.join(self.dataset_dir, type_ + '.txt')
-            with open(self.json_path, 'r') as f:
-                self.data = f.readlines()
-            self.corpus_line = len(self.data)
+            with open(self.json_path, 'rb') as f:
+                self.buffer = f.read()
+            self.line_offsets = buffer_line_index(self.buffer)
+            self.corpus_line = len(self.line_offsets) - 1
         else:
             self.json_path = os.path.join(self.dataset_dir, type_ + '.txt')
-            self.corpus_line = 0
-            with open(self.json_path, 'r') as f:
-                for _ in f:
-                    self.corpus_line += 1
-            self.file = open(self.json_path, 'r')
+            self.line_offsets, self.line_stats = load_line_index(self.json_path)
+            self.corpus_line = len(self.line_offsets) - 1
+            self.file, self.file_pid = None, None
         if self.args.tiny_data > 0:
             self.corpus_line = self.args.tiny_data
         self.hop = self.args.hop
+        self.dtypes = compact_dtypes(args) if self.args.compact_dtype else dict()
         # self.rp_sample = self.args.rp_sample
+        self.cache = None
+        if self.args.sample_cache:
+            if self.args.data_format == 'binary':
+                source_path = os.path.join(self.dataset_dir, type_ + '_bin', 'meta.json')
+            else:
+                source_path = self.json_path
+            key = cache_key(source_path, self.corpus_line, args, s_vocab, t_vocab)
+            cache_dir = os.path.join(self.dataset_dir, 'cache', '{}_{}'.format(type_, key))
+            if not os.path.exists(cache_dir):
+                SampleCache.build(self, cache_dir, args.num_workers)
+            self.cache = SampleCache(cache_dir)
 
     def __len__(self):
         return self.corpus_line
 
+    def sample_sizes(self):
+        '''
+        token num and unique relative path num of every sample, clipped as in process, for BucketBatchSampler
+        '''
+        if self.args.data_format == 'binary':
+            lengths = np.diff(self.corpus.offsets['content'])[:self.corpus_line]
+            path_nums = np.diff(self.corpus.offsets['paths'])[:self.corpus_line]
+        elif not self.on_memory:
+            # counted when the line index is built
+            lengths, path_nums = self.line_stats[:self.corpus_line, 0], self.line_stats[:self.corpus_line, 1]
+        else:
+            sizes = np.zeros((self.corpus_line, 2), dtype=np.int64)
+            for item in range(self.corpus_line):
+                start, end = self.line_offsets[item], self.line_offsets[item + 1]
+                sizes[item] = line_sizes(self.buffer[start:end])
+            lengths, path_nums = sizes[:, 0], sizes[:, 1]
+        return np.minimum(lengths, self.args.max_code_length), np.minimum(path_nums, self.args.max_path_num)
+
     def __getitem__(self, item):
         assert item < self.corpus_line
-        data = self.get_corpus_line(item)
-        sample = self.process(data)
-        return {key: value if torch.is_tensor(value) or isinstance(value, dict) else torch.tensor(value) for key, value
-                in sample.items()}
+        if self.cache is not None:
+            sample = self.cache.get(item)
+        else:
+            sample = self.process(dict(self.get_corpus_line(item), index=item))
+        return {key: to_tensor(value, self.dtypes.get(key)) for key, value in sample.items()}
 
     def process(self, data):
         if self.args.pointer:
             assert self.args.uni_vocab, 'separate vocab not support'
-            e_voc, e_voc_, voc_len = make_extended_vocabulary(data['content'], self.s_vocab)
+            e_voc, _, voc_len = make_extended_vocabulary(data['content'], self.s_vocab)
         else:
-            e_voc, e_voc_, voc_len = None, None, None
+            e_voc, voc_len = None, None
         f_source, f_target = decoder_process(data['target'], self.t_vocab, self.args.max_target_len,
                                              e_voc, self.args.pointer)
         row_ = row_process(data['row'], self.args.max_code_length)
@@ -72,69 +114,214 @@ class PathAttenDataset(Dataset):
                                                                      self.args.max_code_length, e_voc,
                                                                      self.args.pointer)
         paths_map_, paths_, paths_mask_ = path_process(data['paths'], data['paths_map'], self.args.max_path_num,
-                                                       self.args.max_code_length, self.args.path_embedding_num,
-                                                       self.args.max_path_length, convert_hop=self.hop)
+                                                       len(content_), self.args.path_embedding_num,
+                                                       self.args.max_path_length, convert_hop=self.hop,
+                                                       sparse=self.args.sparse_path_map, once=self.args.paths_once)
         r_paths_, r_path_idx_, r_paths_mask_ = r_path_process(data['r_paths'], data['r_path_idx'],
                                                               self.args.max_r_path_num,
-                                                              self.args.max_code_length, self.args.max_r_path_length,
-                                                              self.args.path_embedding_num, convert_hop=self.hop)
+                                                              len(content_), self.args.max_r_path_length,
+                                                              self.args.path_embedding_num, convert_hop=self.hop,
+                                                              once=self.args.paths_once)
         cls_num = data['target']
         cls_num = ''.join(cls_num)
         cls_num = int(cls_num)
         data_dic = {'f_source': f_source, 'f_target': f_target, 'content': content_, 'content_mask': content_mask_,
-                    'path_map': paths_map_, 'paths': paths_, 'paths_mask': paths_mask_, 'named': named_, 'row': row_,
+                    'paths': paths_, 'paths_mask': paths_mask_, 'named': named_, 'row': row_,
                     'r_paths': r_paths_, 'r_path_idx': r_path_idx_, 'r_paths_mask': r_paths_mask_,
                     'target': cls_num}
+        if self.args.sparse_path_map:
+            data_dic['path_map_coo'] = paths_map_
+        else:
+            data_dic['path_map'] = paths_map_
         if self.args.pointer:
-            data_dic['e_voc'] = e_voc
-            data_dic['e_voc_'] = e_voc_
+            data_dic['index'] = data['index']
             data_dic['voc_len'] = voc_len
             data_dic['content_e'] = content_e
         return data_dic
 
+    def extended_vocabulary(self, item):
+        '''
+        rebuild the out of vocab ids of a sample, only for turning the pointer outputs into strings
+        :return: {idx: token}
+        '''
+        _, e_voc_, _ = make_extended_vocabulary(self.get_corpus_line(item)['content'], self.s_vocab)
+        return e_voc_
+
     def get_corpus_line(self, item):
-        if self.on_memory:
-            data = self.data[item]
-            return convert_line(data)
-        else:
-            if item == 0:
-                self.file.close()
-                self.file = open(self.json_path, 'r')
-            line = self.file.__next__()
-            if line is None:
-                self.file.close()
-                self.file = open(self.json_path, 'r')
-                line = self.file.__next__()
-            data = convert_line(line)
+        if self.args.data_format == 'binary':
+            data = self.corpus.get(item)
+            for key in ['named', 'row']:
+                data[key] = data[key].tolist()
             return data
+        else:
+            return convert_line(self.get_raw_line(item))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if 'file' in state:
+            state['file'], state['file_pid'] = None, None
+        return state
+
+    def get_raw_line(self, item):
+        '''
+        decode the line of item from the buffer, or seek to it in the txt file for on_memory=False
+        '''
+        start, end = self.line_offsets[item], self.line_offsets[item + 1]
+        if self.on_memory:
+            return self.buffer[start:end].decode('utf-8')
+        if self.file_pid != os.getpid():
+            # every DataLoader worker opens its own handle, a forked one would share the file position
+            self.file, self.file_pid = open(self.json_path, 'rb'), os.getpid()
+        self.file.seek(start)
+        return self.file.read(end - start).decode('utf-8')
+
+
+def buffer_line_index(buffer):
+    '''
+    byte offsets of the lines in buffer plus its size, split as iterating over the file
+    '''
+    ends = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == ord('\n')) + 1
+    if len(buffer) > 0 and (len(ends) == 0 or ends[-1] != len(buffer)):
+        ends = np.append(ends, len(buffer))
+    return np.concatenate([[0], ends]).astype(np.int64)
 
 
-def collect_fn(batch):
+def line_sizes(line):
+    '''
+    token num and relative path num of a raw line (bytes), without converting it
+    '''
+    fields = line.split(b'\t', 4)
+    if len(fields) < 4:
+        return 0, 0
+    return fields[1].count(b'|') + 1, fields[3].count(b'|') + 1
+
+
+def load_line_index(txt_path):
+    '''
+    byte offsets of the lines of txt_path plus the file size, so line i is [offsets[i], offsets[i+1]),
+    and the line_sizes of every line for BucketBatchSampler.
+    They are stored once in <txt_path>.idx.npy as rows (offset, token num, path num) and rebuilt when the txt file
+    changes
+    :return: offsets (line num + 1,), sizes (line num, 2)
+    '''
+    index_path = txt_path + '.idx.npy'
+    size = os.path.getsize(txt_path)
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(txt_path):
+        index = np.load(index_path)
+        if index.ndim == 2 and len(index) > 0 and index[-1, 0] == size:
+            return index[:, 0], index[:-1, 1:]
+    index = [(0, 0, 0)]
+    with open(txt_path, 'rb') as f:
+        for line in f:
+            index[-1] = (index[-1][0],) + line_sizes(line)
+            index.append((index[-1][0] + len(line), 0, 0))
+    index = np.array(index, dtype=np.int64)
+    with open(index_path + '.tmp', 'wb') as f:
+        np.save(f, index)
+    os.replace(index_path + '.tmp', index_path)
+    return index[:, 0], index[:-1, 1:]
+
+
+def fit_dtype(max_value, signed=False):
+    for dtype in ([np.int16, np.int32] if signed else [np.uint8, np.int16, np.int32]):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def compact_dtypes(args):
+    '''
+    the smallest dtype of every index field, the padding values of collect_fn included,
+    the model widens them to long on the device
+    :return: {key: numpy dtype}
+    '''
+    path_node = fit_dtype(args.path_embedding_num)
+    # paths_once stores up to twice the max length, see bidirectional_paths
+    path_length = fit_dtype(2 * max(args.max_path_length, args.max_r_path_length))
+    # the pair map and r_path_idx use -1 for padding before collect_fn
+    path_idx = fit_dtype(max(args.max_code_length, args.max_path_num * 2), signed=True)
+    return {'f_source': np.int32, 'f_target': np.int32, 'content': np.int32, 'content_e': np.int32,
+            'content_mask': np.uint8, 'named': np.uint8, 'row': np.int32,
+            'paths': path_node, 'r_paths': path_node, 'paths_mask': path_length, 'r_paths_mask': path_length,
+            'path_map': path_idx, 'path_map_coo': path_idx,
+            'r_path_idx': fit_dtype(args.max_r_path_num, signed=True)}
+
+
+def to_tensor(value, dtype=None):
+    if torch.is_tensor(value) or isinstance(value, dict):
+        return value
+    if dtype is not None:
+        value = np.asarray(value, dtype=dtype)
+    if isinstance(value, np.ndarray):
+        return torch.from_numpy(value)
+    return torch.tensor(value)
+
+
+def pad_stack(values, padding_value, min_size=0):
+    '''
+    stack tensors of different shapes, every dim is padded to the max of the batch
+    :param min_size: lower bound of the padded dims, so that an empty field still has one padding entry
+    :return: bs,*max shape
+    '''
+    shape = torch.tensor([list(value.shape) for value in values]).max(dim=0).values.clamp(min=min_size).tolist()
+    out = values[0].new_full([len(values)] + shape, padding_value)
+    for i, value in enumerate(values):
+        out[(i,) + tuple(slice(0, size) for size in value.shape)] = value
+    return out
+
+
+def densify_path_map(coo_list, max_content_len, pad):
+    '''
+    build the dense path_map of a batch from the COO triples of the samples
+    :param coo_list: list of (n, 3) tensors of (row, col, path idx)
+    :param max_content_len:
+    :param pad: the padding path idx, i.e. the path num of the batch
+    :return: bs,max_content_len,max_content_len, in the dtype of the triples
+    '''
+    path_map = torch.full((len(coo_list), max_content_len, max_content_len), pad, dtype=coo_list[0].dtype)
+    batch_idx = torch.cat([torch.full((len(coo),), i, dtype=torch.long) for i, coo in enumerate(coo_list)])
+    coo = torch.cat(coo_list, dim=0)
+    rows, cols = coo[:, 0].long(), coo[:, 1].long()
+    keep = (rows < max_content_len) & (cols < max_content_len)
+    path_map[batch_idx[keep], rows[keep], cols[keep]] = coo[keep, 2]
+    return path_map
+
+
+def collect_fn(batch, path_padding_idx, paths_once=False):
+    '''
+    :param path_padding_idx: the padding idx of path nodes, i.e. args.path_embedding_num
+    :param paths_once: the samples keep each path once (args.paths_once), the encoded paths are still interleaved
+                       as forward/backward, so the relative padding path idx is twice the path num
+    '''
     data = dict()
-    max_content_len, max_target_len = 0, 0
-    for sample in batch:
-        c_l = torch.count_nonzero(sample['content_mask']).item()
-        f_l = torch.count_nonzero(sample['f_source']).item()
-        if c_l > max_content_len: max_content_len = c_l
-        if f_l > max_target_len: max_target_len = f_l
-    data['f_source'] = torch.stack([b['f_source'] for b in batch], dim=0)[:, :max_target_len]
-    data['f_target'] = torch.stack([b['f_target'] for b in batch], dim=0)[:, :max_target_len]
-    data['content'] = torch.stack([b['content'] for b in batch], dim=0)[:, :max_content_len]
-    data['content_mask'] = torch.stack([b['content_mask'] for b in batch], dim=0)[:, :max_content_len]
-    data['path_map'] = torch.stack([b['path_map'] for b in batch], dim=0)[:, :max_content_len, :max_content_len]
-    data['paths'] = torch.stack([b['paths'] for b in batch], dim=0)
-    data['paths_mask'] = torch.stack([b['paths_mask'] for b in batch], dim=0)
-    data['named'] = torch.stack([b['named'] for b in batch], dim=0)[:, :max_content_len]
-    data['row'] = torch.stack([b['row'] for b in batch], dim=0)[:, :max_content_len]
-    data['r_paths'] = torch.stack([b['r_paths'] for b in batch], dim=0)
-    data['r_path_idx'] = torch.stack([b['r_path_idx'] for b in batch], dim=0)[:, :max_content_len]
-    data['r_paths_mask'] = torch.stack([b['r_paths_mask'] for b in batch], dim=0)
-    if 'e_voc' in batch[0]:
-        data['e_voc'] = [b['e_voc'] for b in batch]
-        data['e_voc_'] = [b['e_voc_'] for b in batch]
+    # without paths_once the rows are forward/backward pairs, so an empty batch still gets one padding pair
+    min_paths = 1 if paths_once else 2
+    # 0 is the pad_index of the vocabs
+    data['f_source'] = pad_stack([b['f_source'] for b in batch], 0)
+    data['f_target'] = pad_stack([b['f_target'] for b in batch], 0)
+    data['content'] = pad_stack([b['content'] for b in batch], 0)
+    max_content_len = data['content'].shape[1]
+    data['content_mask'] = pad_stack([b['content_mask'] for b in batch], 0)
+    data['paths'] = pad_stack([b['paths'] for b in batch], path_padding_idx, min_size=min_paths)
+    data['paths_mask'] = pad_stack([b['paths_mask'] for b in batch], 1, min_size=min_paths)  # 1 not 0 for padded path
+    path_num = data['paths'].shape[1] * (2 if paths_once else 1)
+    if 'path_map_coo' in batch[0]:
+        data['path_map'] = densify_path_map([b['path_map_coo'] for b in batch], max_content_len, pad=path_num)
+    else:
+        data['path_map'] = pad_stack([b['path_map'] for b in batch], -1)
+        data['path_map'][data['path_map'] < 0] = path_num
+    data['named'] = pad_stack([b['named'] for b in batch], 2)  # 2 for padding
+    data['row'] = pad_stack([b['row'] for b in batch], 0)
+    data['r_paths'] = pad_stack([b['r_paths'] for b in batch], path_padding_idx, min_size=min_paths)
+    data['r_paths_mask'] = pad_stack([b['r_paths_mask'] for b in batch], 1, min_size=min_paths)
+    data['r_path_idx'] = pad_stack([b['r_path_idx'] for b in batch], -1)
+    # forward and reversed absolute paths are merged into one by the embedding
+    data['r_path_idx'][data['r_path_idx'] < 0] = data['r_paths'].shape[1] // (1 if paths_once else 2)
+    if 'voc_len' in batch[0]:
+        data['index'] = torch.stack([b['index'] for b in batch], dim=0)
         max_voc_len = torch.max(torch.stack([b['voc_len'] for b in batch], dim=0)).item()
         data['voc_len'] = torch.tensor(
             [max_voc_len for _ in batch])  # we set e voc len equal for all data in batch, for data parallel
-        data['content_e'] = torch.stack([b['content_e'] for b in batch], dim=0)[:, :max_content_len]
+        data['content_e'] = pad_stack([b['content_e'] for b in batch], 0)
     data['target'] = torch.stack([b['target'] for b in batch], dim=0)
     return data
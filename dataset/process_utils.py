@@ -1,5 +1,4 @@
-def abs(length):
-    return length if length >= 0 else 0
+import numpy as np
 
 
 def convert_line(line):
@@ -22,140 +21,141 @@ def convert_line(line):
 
 
 def decoder_process(target, vocab, max_target_len, e_voc=None, pointer=False):
-    f_s = [vocab.find(sub_token) for sub_token in target]  # f_s not should been map, because need embedded
+    f_s = vocab.encode(target)  # f_s not should been map, because need embedded
     if not pointer:
-        f_t = [vocab.find(sub_token) for sub_token in target]
+        f_t = f_s
     else:
         assert e_voc is not None
-        f_t = []
-        for sub_token in target:
-            if sub_token in e_voc:
-                f_t.append(e_voc[sub_token])
-            else:
-                f_t.append(vocab.find(sub_token))
-                # here still exist unk in f_t, cause perhaps some word not presented in method body
-    f_source = [vocab.sos_index] + f_s
-    f_source = f_source[:max_target_len] + [vocab.pad_index] * abs(max_target_len - len(f_source))
-    # f_source: max_target_len
-    f_target = f_t + [vocab.eos_index]
-    f_target = f_target[:max_target_len] + [vocab.pad_index] * abs(max_target_len - len(f_target))
-    # f_target: max_target_len
+        f_t = vocab.encode(target, e_voc)
+        # here still exist unk in f_t, cause perhaps some word not presented in method body
+    f_source = np.concatenate([[vocab.sos_index], f_s])[:max_target_len]
+    f_target = np.concatenate([f_t, [vocab.eos_index]])[:max_target_len]
+    # f_source, f_target: <= max_target_len, padded in collect_fn
     return f_source, f_target
 
 
 def row_process(row, max_code_length):
     min_row = min(row)
-    row = [num - min_row + 1 for num in row]  # 0 for padding
-    row_ = row[:max_code_length] + [0] * abs(max_code_length - len(row))
+    row_ = [num - min_row + 1 for num in row[:max_code_length]]  # 0 for padding
     return row_
 
 
 def content_process(content, named, vocab, max_code_length, e_voc=None, pointer=False):
-    content_ = [vocab.find(token) for token in content]
+    content = content[:max_code_length]
+    content_ = vocab.encode(content)
     if not pointer:
         content_e = None
     else:
         assert e_voc is not None
-        content_e = []
-        for sub_token in content:
-            if sub_token in e_voc:
-                content_e.append(e_voc[sub_token])
-            else:
-                content_e.append(vocab.find(sub_token))
-    content_ = content_[:max_code_length] + [vocab.pad_index] * abs(max_code_length - len(content))
-    if pointer:
-        content_e = content_e[:max_code_length] + [vocab.pad_index] * abs(max_code_length - len(content))
-    # content_: max_code_length
-    content_mask_ = [1 for _ in content][:max_code_length] + [0] * abs(
-        max_code_length - len(content))
-    named_ = named[:max_code_length] + [2] * abs(max_code_length - len(named))  # 2 for padding
+        content_e = vocab.encode(content, e_voc)
+    # content_: <= max_code_length, padded in collect_fn
+    content_mask_ = np.ones(len(content_), dtype=np.int64)
+    named_ = named[:max_code_length]
     return content_, content_mask_, named_, content_e
 
 
-def path_process(paths, paths_map, max_path_num, max_code_length, path_embedding_num, max_path_length,
-                 convert_hop=False):
-    import torch
+def flatten(lists):
+    '''
+    :param lists: list of lists (or of 1-d arrays)
+    :return: concatenated int64 values and the length of each list
+    '''
+    lengths = np.array([len(value) for value in lists], dtype=np.int64)
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype=np.int64), lengths
+    return np.concatenate([np.asarray(value, dtype=np.int64) for value in lists]), lengths
+
+
+def bidirectional_paths(paths, max_num, max_length, path_embedding_num, convert_hop=False, once=False):
+    '''
+    path i is put in row 2i and its reversed path in row 2i+1 of a matrix as wide as the longest kept path,
+    the rest is filled with path_embedding_num (the padding idx of path)
+    :param once: only keep path i in row i, PathEmbedding reverses it on the device. The reversed path is clipped
+                 to the last max_length nodes, so a longer path keeps its first and its last max_length nodes
+                 (at most 2*max_length) and the mask is this stored length, PathEmbedding clips both directions
+    :return: paths_ (path num*2, <= max_length), paths_mask_ (path num*2,), path num rows when once
+    '''
+    paths = paths[:max_num]
+    if len(paths) == 0:
+        return np.full((0, 1), path_embedding_num, dtype=np.int64), np.ones(0, dtype=np.int64)
+    flat, lengths = flatten(paths)
+    offsets = np.cumsum(lengths) - lengths
+    if once:
+        stored = np.minimum(lengths, 2 * max_length)
+        width = max(int(stored.max()), 1)
+        paths_ = np.full((len(paths), width), path_embedding_num, dtype=np.int64)
+        col = np.arange(width)
+        valid = col[None, :] < stored[:, None]
+        # the first max_length nodes, then the tail
+        src = np.where(col[None, :] < max_length, col[None, :], (lengths - stored)[:, None] + col[None, :])
+        paths_[valid] = 0 if convert_hop else flat[(offsets[:, None] + src)[valid]]
+        return paths_, stored
+    clipped = np.minimum(lengths, max_length)
+    width = max(int(clipped.max()), 1)
+    paths_ = np.full((len(paths) * 2, width), path_embedding_num, dtype=np.int64)
+    paths_mask_ = np.empty(len(paths) * 2, dtype=np.int64)
+    col = np.arange(width)
+    valid = col[None, :] < clipped[:, None]
+    forward = paths_[0::2]
+    if convert_hop:
+        forward[valid] = 0
+    else:
+        forward[valid] = flat[(offsets[:, None] + col[None, :])[valid]]
+    paths_mask_[0::2] = clipped
+    backward = paths_[1::2]
+    if convert_hop:
+        backward[valid] = 0
+    else:
+        backward[valid] = flat[(offsets[:, None] + lengths[:, None] - 1 - col[None, :])[valid]]
+    paths_mask_[1::2] = clipped
+    return paths_, paths_mask_
+
+
+def path_process(paths, paths_map, max_path_num, code_length, path_embedding_num, max_path_length,
+                 convert_hop=False, sparse=False, once=False):
+    '''
+    :param code_length: the num of kept code tokens, pairs beyond it are dropped
+    :param sparse: return the pair map as COO triples (row, col, path idx) of the non padding cells,
+                   and leave the dense map to collect_fn
+    '''
     # paths => # [[,,,,],[,,,,,]]
     # paths_map =>  # [[l,r],idx] => {idx:[l,r,l,r]}
-    paths_map_ = [[max_path_num * 2 for _ in range(max_code_length)] for _ in
-                  range(max_code_length)]  # we use <max_path_num>*2 to index the padding path
-    paths_map_ = torch.tensor(paths_map_)
-
     # 1) use max_path_num to filter paths
-    paths = paths[:max_path_num]
-    # 2) use filtered paths and max_code_length to filter paths_map
-
-    for key, value in enumerate(paths_map):
-        assert len(value) % 2 == 0
-        if int(key) >= max_path_num: break
-        for i in range(0, len(value), 2):
-            l, r = value[i], value[i + 1]
-            if l >= max_code_length or r >= max_code_length:
-                continue
-            paths_map_[l, r] = int(key) * 2
-            paths_map_[r, l] = int(key) * 2 + 1
-
-    paths_mask_ = []
-    paths_ = []
-    for path in paths:
-        if not convert_hop:
-            paths_.append(
-                path[:max_path_length] + [path_embedding_num] * abs(
-                    max_path_length - len(path)))  # use path node num as padding idx of path
-        else:
-            paths_.append(
-                [0] * min(max_path_length, len(path)) + [path_embedding_num] * abs(max_path_length - len(path)))
-        paths_mask_.append(len(path) if len(path) < max_path_length else max_path_length)
-        if not convert_hop:
-            paths_.append(
-                list(reversed(path))[:max_path_length] + [path_embedding_num] * abs(
-                    max_path_length - len(path)))  # use path node num as padding idx of path
-        else:
-            paths_.append(
-                [0] * min(max_path_length, len(path)) + [path_embedding_num] * abs(max_path_length - len(path)))
-        paths_mask_.append(len(path) if len(path) < max_path_length else max_path_length)
-        # reversed path for bidirectional gru
-
-    assert len(paths_) <= max_path_num * 2
-    assert len(paths_mask_) <= max_path_num * 2
-    paths_ = paths_ + [[path_embedding_num] * max_path_length] * (
-            max_path_num * 2 - len(paths_))
-    paths_mask_ = paths_mask_ + [1] * (
-            max_path_num * 2 - len(paths_mask_))  # 1 not 0 for padded path length
+    # 2) use filtered paths and code_length to filter paths_map
+    pairs, lengths = flatten(paths_map[:max_path_num])
+    assert np.all(lengths % 2 == 0)
+    pairs = pairs.reshape(-1, 2)
+    keys = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths // 2)
+    keep = (pairs[:, 0] < code_length) & (pairs[:, 1] < code_length)
+    l, r, keys = pairs[keep, 0], pairs[keep, 1], keys[keep]
+    # the writes are interleaved as [l, r] -> 2key, [r, l] -> 2key+1, and a later write wins
+    cells = np.stack([l * code_length + r, r * code_length + l], axis=1).reshape(-1)
+    values = np.stack([keys * 2, keys * 2 + 1], axis=1).reshape(-1)
+    _, last = np.unique(cells[::-1], return_index=True)
+    last = len(cells) - 1 - last
+    if sparse:
+        paths_map_ = np.stack([cells[last] // code_length, cells[last] % code_length, values[last]], axis=1)
+    else:
+        paths_map_ = np.full((code_length, code_length), -1,
+                             dtype=np.int64)  # -1 is replaced by the padding path idx of the batch in collect_fn
+        paths_map_.reshape(-1)[cells[last]] = values[last]
+
+    # reversed path for bidirectional gru
+    paths_, paths_mask_ = bidirectional_paths(paths, max_path_num, max_path_length, path_embedding_num,
+                                              convert_hop, once)  # use path node num as padding idx of path
     return paths_map_, paths_, paths_mask_
 
 
-def r_path_process(r_paths, r_path_idx, max_r_path_num, max_code_length, max_r_path_length, path_embedding_num,
-                   convert_hop=False):
+def r_path_process(r_paths, r_path_idx, max_r_path_num, code_length, max_r_path_length, path_embedding_num,
+                   convert_hop=False, once=False):
     # r_paths => # [[79,0],[...],[...]]
     # r_path_idx =>  # [0,1,1,1,3,,2,3,...]
-    r_paths = r_paths[:max_r_path_num]
-    r_path_idx_ = [idx if idx < max_r_path_num else max_r_path_num for idx in r_path_idx][
-                  :max_code_length] + [max_r_path_num] * abs(
-        max_code_length - len(r_path_idx))  # we use <max_r_path_num> to index the padding path
-    r_paths_ = []
-    r_paths_mask_ = []
-    for r_path in r_paths:
-        if not convert_hop:
-            r_paths_.append(r_path[:max_r_path_length] + [path_embedding_num] * abs(max_r_path_length - len(r_path)))
-        else:
-            r_paths_.append(
-                [0] * min(max_r_path_length, len(r_path)) + [path_embedding_num] * abs(max_r_path_length - len(r_path)))
-        r_paths_mask_.append(
-            len(r_path) if len(r_path) < max_r_path_length else max_r_path_length)
-        if not convert_hop:
-            r_paths_.append(list(reversed(r_path))[:max_r_path_length] +
-                            [path_embedding_num] * abs(max_r_path_length - len(r_path)))
-        else:
-            r_paths_.append(
-                [0] * min(max_r_path_length, len(r_path)) + [path_embedding_num] * abs(max_r_path_length - len(r_path)))
-        r_paths_mask_.append(
-            len(r_path) if len(r_path) < max_r_path_length else max_r_path_length)
-
-    r_paths_ = r_paths_ + [[path_embedding_num] * max_r_path_length] * (
-            max_r_path_num * 2 - len(r_paths_))
-    r_paths_mask_ = r_paths_mask_ + [1] * (
-            max_r_path_num * 2 - len(r_paths_mask_))
+    r_path_idx = np.asarray(r_path_idx, dtype=np.int64)[:code_length]
+    r_path_num = min(len(r_paths), max_r_path_num)
+    r_path_idx_ = np.full(code_length, -1,
+                          dtype=np.int64)  # -1 is replaced by the padding path idx of the batch in collect_fn
+    r_path_idx_[:len(r_path_idx)] = np.where(r_path_idx < r_path_num, r_path_idx, -1)
+    r_paths_, r_paths_mask_ = bidirectional_paths(r_paths, max_r_path_num, max_r_path_length, path_embedding_num,
+                                                  convert_hop, once)
     return r_paths_, r_path_idx_, r_paths_mask_
 
 
@@ -0,0 +1,75 @@
+import numpy as np
+from torch.utils.data import Sampler
+
+
+class BucketBatchSampler(Sampler):
+    '''
+    Batch sampler that groups snippets of similar size, so that the padded batch (see collect_fn) wastes little
+
+    Every epoch the samples are shuffled and cut into buckets of bucket_size samples, each bucket is sorted by
+    token num and then unique path num, and consecutive samples are packed into one batch while its cost fits in
+    max_cost. The order of the batches is shuffled again.
+
+    The cost is quadratic in the token num, because of the attention and the path_map:
+    'max' is max(L)^2 * B, i.e. the size of the padded batch, and 'sum' is sum(L^2)
+    '''
+
+    def __init__(self, lengths, path_nums, max_cost, cost='max', max_batch_size=None, bucket_size=6400,
+                 shuffle=True, seed=0):
+        '''
+        :param lengths: token num of every sample, already clipped by max_code_length
+        :param path_nums: unique relative path num of every sample, already clipped by max_path_num
+        :param max_cost: the budget of one batch, a sample exceeding it alone still forms a batch
+        :param max_batch_size: upper bound of the batch size, e.g. accu_batch_size so a batch never spans two steps
+        '''
+        assert cost in ['max', 'sum']
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.path_nums = np.asarray(path_nums, dtype=np.int64)
+        assert len(self.lengths) == len(self.path_nums)
+        self.max_cost = max_cost
+        self.cost = cost
+        self.max_batch_size = max_batch_size if max_batch_size else len(self.lengths)
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.batches = None
+
+    def make_batches(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        order = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        batches = []
+        for start in range(0, len(order), self.bucket_size):
+            bucket = order[start:start + self.bucket_size]
+            bucket = bucket[np.lexsort((self.path_nums[bucket], self.lengths[bucket]))]
+            batch, batch_cost, max_len = [], 0, 0
+            for idx in bucket.tolist():
+                length = int(self.lengths[idx])
+                if self.cost == 'max':
+                    new_cost = max(max_len, length) ** 2 * (len(batch) + 1)
+                else:
+                    new_cost = batch_cost + length ** 2
+                if batch and (new_cost > self.max_cost or len(batch) >= self.max_batch_size):
+                    batches.append(batch)
+                    batch, max_len = [], 0
+                    new_cost = length ** 2
+                batch.append(idx)
+                batch_cost, max_len = new_cost, max(max_len, length)
+            if batch:
+                batches.append(batch)
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        if self.batches is None:
+            self.batches = self.make_batches()
+        batches, self.batches = self.batches, None
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self):
+        # the batches of the coming epoch are made here so that len() matches what __iter__ yields
+        if self.batches is None:
+            self.batches = self.make_batches()
+        return len(self.batches)
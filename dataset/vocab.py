@@ -1,5 +1,8 @@
 import os
 import json
+import hashlib
+from itertools import repeat
+import numpy as np
 
 PAD, UNK, EOS, SOS = '<PAD>', '<UNK>', '<EOS>', '<SOS>'
 
@@ -14,6 +17,18 @@ class Vocab(object):
     def find(self, sub_token):
         return self.vocab.get(sub_token, self.unk_index)
 
+    def encode(self, tokens, extended=None):
+        '''
+        batched find, the lookups run in C through map instead of a python loop
+        :param extended: {token: idx} of the pointer network, its ids override the unk of the vocab
+        :return: int64 array of ids
+        '''
+        ids = np.fromiter(map(self.vocab.get, tokens, repeat(self.unk_index)), dtype=np.int64, count=len(tokens))
+        if extended:
+            e_ids = np.fromiter(map(extended.get, tokens, repeat(-1)), dtype=np.int64, count=len(tokens))
+            ids = np.where(e_ids >= 0, e_ids, ids)
+        return ids
+
     def has_token(self, token):
         if token in self.vocab:
             return True
@@ -43,6 +58,36 @@ class Vocab(object):
     def __len__(self):
         return len(self.vocab)
 
+    def load_tokens(self, name, sources, params, build):
+        '''
+        the ordered tokens of the vocab, cached in data/<dataset>/cache/vocab_<name>_<key>.tokens
+        as a NUL separated utf-8 string table, so the json counts are only read and sorted once
+        :param sources: the json files the tokens come from
+        :param params: the args that change the cut-off
+        :param build: returns the ordered token list from the sources
+        '''
+        key = json.dumps({'sources': [[os.path.abspath(path), os.path.getsize(path), os.path.getmtime(path)]
+                                      for path in sources], 'params': params}, sort_keys=True)
+        cache_path = os.path.join(self.dataset_dir, 'cache', 'vocab_{}_{}.tokens'.format(
+            name, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]))
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                table = f.read().decode('utf-8')
+            return table.split('\0') if table else []
+        tokens = build()
+        if not any('\0' in token for token in tokens):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path + '.tmp', 'wb') as f:
+                f.write('\0'.join(tokens).encode('utf-8'))
+            os.replace(cache_path + '.tmp', cache_path)
+        return tokens
+
+    def add_tokens(self, tokens):
+        for key in tokens:
+            self.vocab[key] = len(self.vocab)
+        print('{} Vocab length == {}'.format(self.type, len(self.vocab)))
+        self.re_vocab = dict(zip(self.vocab.values(), self.vocab.keys()))
+
 
 class CTTextVocab(Vocab):
     def __init__(self, args):
@@ -53,13 +98,14 @@ class CTTextVocab(Vocab):
         self.type = 'CT'
         print('Get CT Vocab')
         self.dataset_dir = os.path.join('./data', args.dataset)
-        with open(os.path.join(self.dataset_dir, 'ct_vocab.json'), 'r') as f:
-            vocab_dict = json.load(f)
-        for key, _ in vocab_dict.items():
-            self.vocab[key] = len(self.vocab)
-        print('{} Vocab length == {}'.format(self.type, len(self.vocab)))
-        for key, value in self.vocab.items():
-            self.re_vocab[value] = key
+        vocab_path = os.path.join(self.dataset_dir, 'ct_vocab.json')
+
+        def build():
+            with open(vocab_path, 'r') as f:
+                vocab_dict = json.load(f)
+            return list(vocab_dict.keys())
+
+        self.add_tokens(self.load_tokens('ct', [vocab_path], {}, build))
 
 
 class UniTextVocab(Vocab):
@@ -68,33 +114,37 @@ class UniTextVocab(Vocab):
         self.type = 'uni'
         print('Get Uni Vocab')
         self.dataset_dir = os.path.join('./data', args.dataset)
-        with open(os.path.join(self.dataset_dir, 'source' + '_vocab.json'), 'r') as f:
-            source_vocab_dict = json.load(f)
-        with open(os.path.join(self.dataset_dir, 'target' + '_vocab.json'), 'r') as f:
-            target_vocab_dict = json.load(f)
-        all_vocab_dict = dict()
-        for key, value in source_vocab_dict.items():
-            if key not in all_vocab_dict:
-                all_vocab_dict[key] = value
-            else:
-                all_vocab_dict[key] += value
-
-        for key, value in target_vocab_dict.items():
-            if key not in all_vocab_dict:
-                all_vocab_dict[key] = value
-            else:
-                all_vocab_dict[key] += value
-
-        ordered_list = sorted(all_vocab_dict.items(), key=lambda item: item[1], reverse=True)
-
-        for key, value in ordered_list:
-            if value < self.args.vocab_threshold:
-                break
-            self.vocab[key] = len(self.vocab)
-        print('{} Vocab length == {}'.format(self.type, len(self.vocab)))
-        self.re_vocab = dict()
-        for key, value in self.vocab.items():
-            self.re_vocab[value] = key
+        source_path = os.path.join(self.dataset_dir, 'source' + '_vocab.json')
+        target_path = os.path.join(self.dataset_dir, 'target' + '_vocab.json')
+
+        def build():
+            with open(source_path, 'r') as f:
+                source_vocab_dict = json.load(f)
+            with open(target_path, 'r') as f:
+                target_vocab_dict = json.load(f)
+            all_vocab_dict = dict()
+            for key, value in source_vocab_dict.items():
+                if key not in all_vocab_dict:
+                    all_vocab_dict[key] = value
+                else:
+                    all_vocab_dict[key] += value
+
+            for key, value in target_vocab_dict.items():
+                if key not in all_vocab_dict:
+                    all_vocab_dict[key] = value
+                else:
+                    all_vocab_dict[key] += value
+
+            ordered_list = sorted(all_vocab_dict.items(), key=lambda item: item[1], reverse=True)
+            tokens = []
+            for key, value in ordered_list:
+                if value < self.args.vocab_threshold:
+                    break
+                tokens.append(key)
+            return tokens
+
+        self.add_tokens(self.load_tokens('uni', [source_path, target_path],
+                                         {'vocab_threshold': self.args.vocab_threshold}, build))
 
 
 class TextVocab(Vocab):
@@ -107,24 +157,27 @@ class TextVocab(Vocab):
         assert type_ in ['source', 'target']
         print('Get {} Vocab'.format(type_))
         self.dataset_dir = os.path.join('./data', args.dataset)
-        with open(os.path.join(self.dataset_dir, type_ + '_vocab.json'), 'r') as f:
-            vocab_dict = json.load(f)
-        self.sum_tokens = 0
-        for key, value in vocab_dict.items():
-            self.sum_tokens += value
-        ordered_list = sorted(vocab_dict.items(), key=lambda item: item[1], reverse=True)
-        temp_sum = 0
         self.type = type_
         if self.type == 'source':
             self.vocab_portion = self.args.s_vocab_portion
         else:
             self.vocab_portion = self.args.t_vocab_portion
-        for key, value in ordered_list:
-            temp_sum += value
-            if temp_sum / self.sum_tokens > self.vocab_portion:
-                break
-            self.vocab[key] = len(self.vocab)
-        print('{} Vocab length == {}'.format(self.type, len(self.vocab)))
-        self.re_vocab = dict()
-        for key, value in self.vocab.items():
-            self.re_vocab[value] = key
+        vocab_path = os.path.join(self.dataset_dir, type_ + '_vocab.json')
+
+        def build():
+            with open(vocab_path, 'r') as f:
+                vocab_dict = json.load(f)
+            sum_tokens = 0
+            for key, value in vocab_dict.items():
+                sum_tokens += value
+            ordered_list = sorted(vocab_dict.items(), key=lambda item: item[1], reverse=True)
+            temp_sum = 0
+            tokens = []
+            for key, value in ordered_list:
+                temp_sum += value
+                if temp_sum / sum_tokens > self.vocab_portion:
+                    break
+                tokens.append(key)
+            return tokens
+
+        self.add_tokens(self.load_tokens(type_, [vocab_path], {'vocab_portion': self.vocab_portion}, build))
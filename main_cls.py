@@ -1,7 +1,8 @@
 import argparse
+from functools import partial
 
 from torch.utils.data import DataLoader
-from dataset import PathAttenDataset, TextVocab, UniTextVocab, collect_fn, CTTextVocab
+from dataset import PathAttenDataset, TextVocab, UniTextVocab, collect_fn, CTTextVocab, BucketBatchSampler
 from trainer import Trainer
 from model import ModelClf as Model
 import torch
@@ -29,7 +30,10 @@ def train():
     # dataset
     parser.add_argument("--dataset", type=str, help="train dataset", default='python',
                         choices=['python', 'ruby', 'javascript', 'go'])
-    parser.add_argument("--on_memory", type=boolean_string, default=True, help="Loading datasets into memory")
+    parser.add_argument("--on_memory", type=boolean_string, default=True,
+                        help="Loading datasets into memory, otherwise seek the lines by a byte offset index")
+    parser.add_argument("--data_format", type=str, default='text', choices=['text', 'binary'],
+                        help="text: <type>.txt lines; binary: memory-mapped <type>_bin dir written by the parser")
     parser.add_argument("--clf_num", type=int, default=800, help="")
     # dataset size
     parser.add_argument("--max_code_length", type=int, default=512, help="")
@@ -37,6 +41,13 @@ def train():
     parser.add_argument("--max_r_path_length", type=int, default=32, help="")
     parser.add_argument("--max_path_num", type=int, default=512, help="the num of unique relative path")
     parser.add_argument("--max_r_path_num", type=int, default=256, help="the num of unique absolute path")
+    parser.add_argument("--sparse_path_map", type=boolean_string, default=True,
+                        help="samples carry the pair map as COO triples, the dense map is built per batch")
+    parser.add_argument("--sample_cache", type=boolean_string, default=False,
+                        help="process every split once into memory-mapped arrays under data/<dataset>/cache, "
+                             "keyed by the data file, the vocab and the size args")
+    parser.add_argument("--compact_dtype", type=boolean_string, default=False,
+                        help="keep the index fields as uint8/int16/int32 up to the model, which widens them on device")
     parser.add_argument("--max_target_len", type=int, default=7, help=' <eos or sos> + true len of method name')
 
     # vocab
@@ -67,6 +78,12 @@ def train():
     parser.add_argument("--label_smoothing", type=float, default=0.1, help="")
     parser.add_argument("--dropout", type=float, default=0.2, help="")
     parser.add_argument("--shuffle", type=boolean_string, default=True, help="whether to shuffle the training data")
+    parser.add_argument("--max_batch_cost", type=int, default=0,
+                        help="0 is fixed batch_size; otherwise bucket the training data by size and fill each batch "
+                             "up to this quadratic token cost, at most accu_batch_size samples")
+    parser.add_argument("--batch_cost", type=str, default='max', choices=['max', 'sum'],
+                        help="max: max(L)^2 * B of the padded batch; sum: sum(L^2)")
+    parser.add_argument("--bucket_size", type=int, default=6400, help="samples sorted together by the bucket sampler")
 
     # glove
     parser.add_argument("--pretrain", type=boolean_string, default=False,
@@ -82,6 +99,19 @@ def train():
     parser.add_argument("--bidirectional", type=boolean_string, default=True, help="for path gru")
     parser.add_argument("--gru_size", type=int, default=64, help="for path gru")
     parser.add_argument("--gru_layers", type=int, default=1, help="for path gru")
+    parser.add_argument("--packed_path_gru", type=boolean_string, default=True,
+                        help="skip the padding paths and steps in the path gru, like packed sequences")
+    parser.add_argument("--paths_once", type=boolean_string, default=False,
+                        help="store each path once and reverse it on the device instead of storing both directions")
+    parser.add_argument("--path_dedup", type=boolean_string, default=True,
+                        help="encode every distinct path of a batch once in the path gru")
+    parser.add_argument("--ap_trie", type=boolean_string, default=False,
+                        help="encode the absolute paths over a prefix trie, one gru step per trie node")
+    parser.add_argument("--path_table", type=int, default=0,
+                        help="inference only: keep the gru output of up to this many distinct paths, 0 for off")
+    parser.add_argument("--path_table_file", type=str, default='',
+                        help="load the path table from this file if it exists and matches the path weights, "
+                             "and save it after the test predictions")
 
     # transformer
     parser.add_argument("--embedding_size", type=int, default=512, help="hidden size of transformer model")
@@ -166,23 +196,29 @@ def train():
     valid_dataset = PathAttenDataset(args, s_vocab, t_vocab, type_='valid')
     print("Loading Test Dataset")
     test_dataset = PathAttenDataset(args, s_vocab, t_vocab, type_='test')
-    if args.on_memory:
-        num_workers = args.num_workers
-    else:
-        num_workers = 0
+    num_workers = args.num_workers
 
     print("Creating Dataloader")
+    collate = partial(collect_fn, path_padding_idx=args.path_embedding_num, paths_once=args.paths_once)
     if args.train:
-        train_data_loader = DataLoader(train_dataset, batch_size=args.batch_size, num_workers=num_workers,
-                                       shuffle=args.shuffle, collate_fn=collect_fn)
+        if args.max_batch_cost > 0:
+            lengths, path_nums = train_dataset.sample_sizes()
+            sampler = BucketBatchSampler(lengths, path_nums, args.max_batch_cost, cost=args.batch_cost,
+                                         max_batch_size=args.accu_batch_size, bucket_size=args.bucket_size,
+                                         shuffle=args.shuffle, seed=np.random.randint(2 ** 31))
+            train_data_loader = DataLoader(train_dataset, batch_sampler=sampler, num_workers=num_workers,
+                                           collate_fn=collate)
+        else:
+            train_data_loader = DataLoader(train_dataset, batch_size=args.batch_size, num_workers=num_workers,
+                                           shuffle=args.shuffle, collate_fn=collate)
     else:
         train_data_loader = None
     valid_data_loader = DataLoader(valid_dataset, batch_size=args.val_batch_size, num_workers=num_workers,
-                                   collate_fn=collect_fn)
+                                   collate_fn=collate)
     valid_infer_data_loader = DataLoader(valid_dataset, batch_size=args.infer_batch_size, num_workers=num_workers,
-                                         collate_fn=collect_fn)
+                                         collate_fn=collate)
     test_infer_data_loader = DataLoader(test_dataset, batch_size=args.infer_batch_size, num_workers=num_workers,
-                                        collate_fn=collect_fn)
+                                        collate_fn=collate)
     print("Building Model")
     model = Model(args, s_vocab, t_vocab)
 
@@ -4,6 +4,9 @@ import torch
 from torch.nn import LayerNorm
 import math
 from torch.nn import init, GRUCell
+from collections import OrderedDict
+import threading
+import hashlib
 
 
 class LayerNormGRUCell(torch.nn.Module):
@@ -65,7 +68,7 @@ class LayerNormGRUCell(torch.nn.Module):
 
 
 class LayerNormGRU(torch.nn.Module):
-    def __init__(self, input_size, hidden_size, gru_ln):
+    def __init__(self, input_size, hidden_size, gru_ln, packed=False, trie=False):
         super(LayerNormGRU, self).__init__()
         if gru_ln:
             self.gru_cell = LayerNormGRUCell(input_size, hidden_size, bias=True)
@@ -73,13 +76,21 @@ class LayerNormGRU(torch.nn.Module):
             self.gru_cell = GRUCell(input_size, hidden_size, bias=True)
         self.input_size = input_size
         self.hidden_size = hidden_size
+        self.packed = packed
+        self.trie = trie
 
-    def forward(self, input, length):
+    def forward(self, input, length, valid=None, ids=None):
         '''
         :param input: bs,len,hidden
         :param length: bs
+        :param valid: bs, False for the padding paths, only used when packed or trie
+        :param ids: bs,len, the node ids of input, only used when trie
         :return:
         '''
+        if self.trie and ids is not None:
+            return self.trie_forward(input, length, ids, valid)
+        if self.packed:
+            return self.packed_forward(input, length, valid)
         bs, l = input.shape[0], input.shape[1]
         h_x = torch.zeros((bs, self.hidden_size)).to(input.device)
         output = []
@@ -91,6 +102,102 @@ class LayerNormGRU(torch.nn.Module):
         return torch.gather(output, 1, ind.unsqueeze(-1).unsqueeze(-1).expand(-1, -1, output.shape[-1])).unsqueeze(1)
         # bs,hidden
 
+    def packed_forward(self, input, length, valid=None):
+        '''
+        like pack_padded_sequence: drop the padding paths, sort the rest by length and only step the paths still alive,
+        the state of a path is final once it leaves the active prefix. The padding paths get a zero state
+        '''
+        keep = length > 0 if valid is None else valid & (length > 0)
+        idx = keep.nonzero(as_tuple=True)[0]
+        lengths, order = length[idx].sort(descending=True)
+        idx = idx[order]
+        output = torch.zeros((input.shape[0], self.hidden_size), device=input.device)
+        if len(idx) == 0:
+            return output.unsqueeze(1)
+        x = input[idx]
+        h_x = torch.zeros((len(idx), self.hidden_size), device=input.device)
+        # the num of alive paths at every step, one sync for the whole loop
+        alive = (lengths.unsqueeze(1) > torch.arange(x.shape[1], device=input.device)).sum(0).tolist()
+        for i, num in enumerate(alive):
+            if num == 0:
+                break
+            h_x = torch.cat((self.gru_cell(x[:num, i, :], h_x[:num]), h_x[num:]), dim=0)
+        return output.index_copy(0, idx, h_x).unsqueeze(1)
+        # bs,hidden
+
+    def trie_forward(self, input, length, ids, valid=None):
+        '''
+        the paths sharing a prefix share the gru state of that prefix, so the paths are merged into a prefix trie
+        level by level and the cell runs once per trie node. A node is a unique (parent node, node id) pair,
+        the state of a path is the state of its node at depth length-1. The padding paths get a zero state
+        '''
+        keep = length > 0 if valid is None else valid & (length > 0)
+        rows = keep.nonzero(as_tuple=True)[0]
+        output = torch.zeros((input.shape[0], self.hidden_size), device=input.device)
+        parent = torch.zeros_like(rows)
+        h_x = torch.zeros((1, self.hidden_size), device=input.device)  # the root
+        end_rows, end_states = [], []
+        for i in range(input.shape[1]):
+            if len(rows) == 0:
+                break
+            nodes, node_idx = torch.unique(torch.stack((parent, ids[rows, i]), dim=1), dim=0, return_inverse=True)
+            # any path through a node has the same node id at this step, so any of them gives its input
+            first = torch.empty(len(nodes), dtype=torch.long, device=input.device).scatter_(0, node_idx, rows)
+            h_x = self.gru_cell(input[first, i, :], h_x[nodes[:, 0]])
+            end = length[rows] == i + 1
+            end_rows.append(rows[end])
+            end_states.append(h_x[node_idx[end]])
+            rows, parent = rows[~end], node_idx[~end]
+        if not end_rows:
+            return output.unsqueeze(1)
+        return output.index_copy(0, torch.cat(end_rows), torch.cat(end_states)).unsqueeze(1)
+        # bs,hidden
+
+
+class PathTable:
+    '''
+    LRU bounded map from a node id tuple to the gru output of the path, for frozen-model inference,
+    the DataParallel replicas share one table so every access holds the lock
+    '''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.table = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.table.get(key)
+            if value is not None:
+                self.table.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        # a copy of the row, a view would keep the output of the whole batch alive
+        value = value.detach().clone()
+        with self.lock:
+            self.table[key] = value
+            self.table.move_to_end(key)
+            if len(self.table) > self.capacity:
+                self.table.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.table.clear()
+
+    def __len__(self):
+        return len(self.table)
+
+    def state_dict(self):
+        with self.lock:
+            keys, values = list(self.table.keys()), list(self.table.values())
+        values = torch.stack([value.cpu() for value in values]) if keys else torch.zeros(0)
+        return {'keys': keys, 'values': values}
+
+    def load_state_dict(self, state):
+        for key, value in zip(state['keys'], state['values']):
+            self.put(tuple(key), value)
+
 
 class PathEmbedding(nn.Module):
     def __init__(self, args):
@@ -108,15 +215,23 @@ class PathEmbedding(nn.Module):
         self.num_directions = 2 if self.args.bidirectional else 1
 
         if self.args.relation_path:
-            self.rp_rnn = LayerNormGRU(self.args.path_embedding_size, self.gru_size, self.args.gru_ln)
+            self.rp_rnn = LayerNormGRU(self.args.path_embedding_size, self.gru_size, self.args.gru_ln,
+                                       self.args.packed_path_gru)
         else:
             self.rp_rnn = None
         if self.args.absolute_path:
-            self.ap_rnn = LayerNormGRU(self.args.path_embedding_size, self.gru_size, self.args.gru_ln)
+            self.ap_rnn = LayerNormGRU(self.args.path_embedding_size, self.gru_size, self.args.gru_ln,
+                                       self.args.packed_path_gru, self.args.ap_trie)
         else:
             self.ap_rnn = None
         if self.args.gru_ln:
             self.gru_ln = LayerNorm(2 * self.gru_size)
+        if self.args.path_table > 0:
+            self.tables = {'relation': PathTable(self.args.path_table), 'absolute': PathTable(self.args.path_table)}
+        else:
+            self.tables = None
+        # the path_table_file is read at the next eval(), once the weights are final
+        self.table_file_checked = False
 
     def forward(self, paths, paths_mask, type='relation'):
         '''
@@ -126,42 +241,138 @@ class PathEmbedding(nn.Module):
         :return:bs,max_path_num,hidden
         '''
         assert type in ['relation', 'absolute']
-        if type == 'relation':
-            p_1 = self.embedding(paths)
-            # bs,max_path_num,max_path_length,dim
-        elif type == 'absolute':
-            if self.args.ap_split:
-                p_1 = self.ap_embedding(paths)
-                # bs,max_path_num,max_path_length,dim
-            else:
-                p_1 = self.embedding(paths)
-                # bs,max_path_num,max_path_length,dim
-        else:
-            raise Exception('Not Valid Path Type !')
-        bs, max_path_num, max_path_length, dim = p_1.shape
-
-        input = p_1.view(-1, max_path_length, dim)
-        # bs*max_path_num,max_path_length,dim
+        bs, max_path_num, max_path_length = paths.shape
 
+        paths = paths.view(-1, max_path_length)
+        # bs*max_path_num,max_path_length
         length = paths_mask.view(-1)
         # bs*max_path_num
+        if self.args.path_dedup:
+            # a node sequence gets the same gru state wherever it is, so every distinct one is encoded once per batch
+            unique, inverse = torch.unique(torch.cat((paths, length.unsqueeze(1)), dim=1), dim=0, return_inverse=True)
+            paths, length = unique[:, :-1], unique[:, -1]
+        if self.tables is not None and not self.training:
+            output = self.lookup_rows(paths, length, type)
+        else:
+            output = self.encode_rows(paths, length, type)
+        # n,hidden or n,2*hidden when paths_once
+        if self.args.path_dedup:
+            output = output[inverse]
 
+        if self.args.paths_once:
+            output = output.view(bs, max_path_num, 2, -1)
+            forward_, backward_ = output[:, :, 0], output[:, :, 1]
+        else:
+            output = output.view(bs, max_path_num, -1)
+            forward_, backward_ = output[:, 0::2], output[:, 1::2]
         if type == 'relation':
-            output = self.rp_rnn(input, length).view(bs, max_path_num, -1)  # output: bs,max_path_num,hidden
-            forward_ = torch.cat((output[:, 0::2, :], output[:, 1::2, :]), dim=-1)  # bs,256,128
-            backward_ = torch.cat((output[:, 1::2, :], output[:, 0::2, :]), dim=-1)
-            output = torch.zeros((bs, max_path_num, self.gru_size * 2)).to(output.device)  # bs,512,128
-            output[:, 0::2, :] = forward_
-            output[:, 1::2, :] = backward_
-            # bs,max_path_num,gru_size*2
-        elif type == 'absolute':
-            output = self.ap_rnn(input, length).view(bs, max_path_num, -1)  # output: bs,max_path_num,hidden
-            output = torch.cat((output[:, 0::2, :], output[:, 1::2, :]), dim=-1)
-            # bs,max_path_num/2,gru_size*2
+            output = torch.stack((torch.cat((forward_, backward_), dim=-1), torch.cat((backward_, forward_), dim=-1)),
+                                 dim=2).view(bs, forward_.shape[1] * 2, -1)
+            # bs,path_num*2,gru_size*2
         else:
-            raise Exception('Not Valid Path Type !')
+            output = torch.cat((forward_, backward_), dim=-1)
+            # bs,path_num,gru_size*2
         # return self.gru_norm(output)
         if self.args.gru_ln:
             output = self.gru_ln(output)
         return output
 
+    def encode_rows(self, paths, length, type):
+        '''
+        :param paths: n,max_path_length
+        :param length: n
+        :return: n,hidden, or n,2*hidden of the forward and reversed path when paths_once
+        '''
+        if type == 'relation':
+            embedding, rnn = self.embedding, self.rp_rnn
+        elif type == 'absolute':
+            embedding = self.ap_embedding if self.args.ap_split else self.embedding
+            rnn = self.ap_rnn
+        else:
+            raise Exception('Not Valid Path Type !')
+        valid = paths[:, 0] != self.args.path_embedding_num
+        # the padding paths of collect_fn start with the padding idx
+        input = embedding(paths)
+        # n,max_path_length,dim
+        if self.args.paths_once:
+            max_length = self.args.max_path_length if type == 'relation' else self.args.max_r_path_length
+            return self.reverse_rnn(rnn, input, length, valid, paths, max_length).reshape(input.shape[0], -1)
+        return rnn(input, length, valid, paths).view(input.shape[0], -1)
+
+    def lookup_rows(self, paths, length, type):
+        '''
+        inference with a path table: the gru output only depends on the node sequence, so it is looked up by
+        the node id tuple and only the missing paths are encoded and put into the table
+        '''
+        table = self.tables[type]
+        keys = [tuple(path[:l]) for path, l in zip(paths.tolist(), length.tolist())]
+        values = [table.get(key) for key in keys]
+        values = [value if value is None else value.to(paths.device) for value in values]
+        miss = [i for i, value in enumerate(values) if value is None]
+        if miss:
+            idx = torch.tensor(miss, device=paths.device)
+            for i, value in zip(miss, self.encode_rows(paths[idx], length[idx], type)):
+                values[i] = value
+                table.put(keys[i], value)
+        return torch.stack(values, dim=0)
+
+    def clear_tables(self):
+        if self.tables is not None:
+            for table in self.tables.values():
+                table.clear()
+        self.table_file_checked = False
+
+    def train(self, mode=True):
+        # the tables are only valid for frozen weights
+        if mode:
+            self.clear_tables()
+        elif self.tables is not None and not self.table_file_checked:
+            self.load_tables(self.args.path_table_file)
+        return super().train(mode)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        self.clear_tables()
+        return super()._load_from_state_dict(*args, **kwargs)
+
+    def fingerprint(self):
+        '''
+        sha1 of the weights of the path encoder, the tables only hold for the weights they were computed with
+        '''
+        h = hashlib.sha1()
+        for name, value in sorted(self.state_dict().items()):
+            h.update(name.encode('utf-8'))
+            h.update(value.detach().cpu().numpy().tobytes())
+        return h.hexdigest()
+
+    def load_tables(self, path):
+        self.table_file_checked = True
+        if not path or not os.path.exists(path):
+            return
+        state = torch.load(path, map_location='cpu')
+        if state.get('fingerprint') != self.fingerprint():
+            print('Path table {} was computed with other weights, dropped'.format(path))
+            return
+        for type, table in state['tables'].items():
+            self.tables[type].load_state_dict(table)
+
+    def save_tables(self, path):
+        torch.save({'fingerprint': self.fingerprint(),
+                    'tables': {type: table.state_dict() for type, table in self.tables.items()}}, path)
+
+    def reverse_rnn(self, rnn, input, length, valid, ids, max_length):
+        '''
+        the paths are stored once (args.paths_once), the reversed paths are gathered here and both directions run
+        through the gru in one call
+        :param input: n,stored path length,dim, a path longer than max_length keeps its head and its tail
+                      (see bidirectional_paths), so both directions are clipped to max_length as without paths_once
+        :param length: n, the stored length
+        :return: n,2,hidden
+        '''
+        steps = torch.arange(input.shape[1], device=input.device)
+        # the steps beyond the length are never read by the gru output, so they are clamped to any valid idx
+        reverse_idx = (length.unsqueeze(1) - 1 - steps).clamp(min=0)
+        reverse = input.gather(1, reverse_idx.unsqueeze(-1).expand(-1, -1, input.shape[-1]))
+        length = length.clamp(max=max_length)
+        output = rnn(torch.cat((input, reverse), dim=0), length.repeat(2), valid.repeat(2),
+                     torch.cat((ids, ids.gather(1, reverse_idx)), dim=0))
+        return output.view(2, input.shape[0], -1).transpose(0, 1)
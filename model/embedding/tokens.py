@@ -1,6 +1,7 @@
 from torch import nn
 import os
-import pickle as pkl
+import json
+import hashlib
 import torch
 import numpy as np
 from tqdm import tqdm
@@ -28,39 +29,45 @@ class TokenEmbedding(nn.Module):
             self.in_ = None
 
     def get_embedding(self):
+        '''
+        stream the embedding file and parse only the vectors of vocab words, in one bulk conversion.
+        The matrix is cached as ./catch/<dataset>/<type>_embedding_<key>.npy, keyed by the vocab,
+        the embedding file (path, size, mtime) and the embedding size
+        '''
         embedding_dir = './catch/{}'.format(self.args.dataset)
         if not os.path.exists(embedding_dir):
             os.makedirs(os.path.join(embedding_dir))
-        embedding_path = './catch/{}/{}_embedding.pkl'.format(self.args.dataset, self.vocab.type)
+        stat = os.stat(self.args.embedding_file)
+        key = json.dumps({'vocab': self.vocab.vocab, 'size': self.args.embedding_size,
+                          'file': [os.path.abspath(self.args.embedding_file), stat.st_size, stat.st_mtime]},
+                         sort_keys=True)
+        embedding_path = os.path.join(embedding_dir, '{}_embedding_{}.npy'.format(
+            self.vocab.type, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]))
         if os.path.exists(embedding_path):
-            with open(embedding_path, 'rb') as f:
-                embedding = pkl.load(f)
-                print('Load Embedding from Catch')
-                self.embedding_matrix = embedding.clone().detach()
-                assert len(embedding) == self.vocab_size
+            embedding = np.load(embedding_path, mmap_mode='r')
+            print('Load Embedding from Catch')
+            assert len(embedding) == self.vocab_size
+            self.embedding_matrix = torch.from_numpy(np.array(embedding))
         else:
-            with open(self.args.embedding_file, 'r') as f:
-                line = f.readline().strip().split()
-                embedding_dim = len(line) - 1
             self.embedding_matrix = torch.randn(self.vocab_size, self.args.embedding_size)
-            count = 0
-            with open(self.args.embedding_file, 'r', encoding='utf-8') as f:
+            idxs, vectors = [], []
+            with open(self.args.embedding_file, 'rb') as f:
                 print('Create {} Embedding from raw data'.format(self.vocab.type))
-                lines = f.readlines()
-                for line in tqdm(lines):
-                    line = line.strip().split()
-                    word = line[0]
-                    idx = self.vocab.find(word)
+                embedding_dim = len(f.readline().split()) - 1
+                f.seek(0)
+                for line in tqdm(f):
+                    word, _, vector = line.strip().partition(b' ')
+                    idx = self.vocab.vocab.get(word.decode('utf-8', errors='replace'), self.vocab.unk_index)
                     if idx != self.vocab.unk_index:
-                        vector = torch.tensor(np.append(np.array(line[1:]),
-                                                        np.array(
-                                                            [0] * (self.args.embedding_size - embedding_dim))).astype(
-                            np.float))
-                        self.embedding_matrix[idx] = vector
-                        count += 1
-                print('Pretrain Word = {} for {}'.format((count / self.vocab_size), self.vocab.type))
-            with open(embedding_path, 'wb') as f:
-                pkl.dump(self.embedding_matrix, f)
+                        idxs.append(idx)
+                        vectors.append(vector)
+            if idxs:
+                vectors = np.array(b' '.join(vectors).split(), dtype=np.float32).reshape(len(idxs), embedding_dim)
+                rows, width = torch.tensor(idxs), min(embedding_dim, self.args.embedding_size)
+                self.embedding_matrix[rows] = 0  # shorter vectors are padded with 0
+                self.embedding_matrix[rows, :width] = torch.from_numpy(vectors[:, :width])
+            print('Pretrain Word = {} for {}'.format((len(set(idxs)) / self.vocab_size), self.vocab.type))
+            np.save(embedding_path, self.embedding_matrix.numpy())
             print('Save {} Embedding into catch'.format(self.vocab.type))
 
 
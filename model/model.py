@@ -42,15 +42,16 @@ class Model(nn.Module):
                 self.additive_attention_v = nn.Parameter(torch.rand(self.args.hidden))
 
     def encode(self, data):
-        content = data['content']
+        # the index fields may come in compact dtypes (--compact_dtype), embedding and gather need long
+        content = data['content'].long()
         content_mask = data['content_mask']
-        path_map = data['path_map']
-        paths = data['paths']
-        paths_mask = data['paths_mask']
-        r_paths = data['r_paths']
-        r_paths_mask = data['r_paths_mask']
-        r_path_idx = data['r_path_idx']
-        named = data['named']
+        path_map = data['path_map'].long()
+        paths = data['paths'].long()
+        paths_mask = data['paths_mask'].long()
+        r_paths = data['r_paths'].long()
+        r_paths_mask = data['r_paths_mask'].long()
+        r_path_idx = data['r_path_idx'].long()
+        named = data['named'].long()
 
         content_ = self.left_embedding(content, named)
         if self.relation_path:
@@ -142,10 +143,10 @@ class Model(nn.Module):
         return out
 
     def forward(self, data):
-        f_source = data['f_source']
+        f_source = data['f_source'].long()
         memory, memory_key_padding_mask = self.encode(data)
         if self.args.pointer:
-            out = self.decode(memory, f_source, memory_key_padding_mask, data['content_e'], data['voc_len'])
+            out = self.decode(memory, f_source, memory_key_padding_mask, data['content_e'].long(), data['voc_len'])
         else:
             out = self.decode(memory, f_source, memory_key_padding_mask)
         return out
@@ -0,0 +1,103 @@
+import os
+import json
+import numpy as np
+
+'''
+Binary layout of a processed split, saved in the <type>_bin dir:
+
+meta.json           {"num": sample num, "fields": {field: levels}}
+tokens.json         the token table, content and target are saved as ids of this table
+<field>.data        int32 values of all samples
+<field>.offsets     int64, num + 1 entries, sample i owns [offsets[i], offsets[i+1])
+                    for level 1 fields the offsets index <field>.data
+                    for level 2 fields (list of lists) the offsets index <field>.inner
+<field>.inner       int64, only for level 2 fields, list k owns data[inner[k]: inner[k+1]]
+'''
+
+FIELDS = {'target': 1, 'content': 1, 'named': 1, 'row': 1, 'r_path_idx': 1,
+          'paths': 2, 'paths_map': 2, 'r_paths': 2}
+TOKEN_FIELDS = ['target', 'content']
+
+
+class BinaryWriter:
+    def __init__(self, save_dir):
+        self.save_dir = save_dir
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        self.num = 0
+        self.token_dic = dict()
+        self.files = dict()
+        self.sizes = dict()
+        for field, levels in FIELDS.items():
+            self.files[field] = {'data': open(os.path.join(save_dir, field + '.data'), 'wb'),
+                                 'offsets': open(os.path.join(save_dir, field + '.offsets'), 'wb')}
+            self.sizes[field] = {'data': 0, 'offsets': 0}
+            self.files[field]['offsets'].write(np.zeros(1, dtype=np.int64).tobytes())
+            if levels == 2:
+                self.files[field]['inner'] = open(os.path.join(save_dir, field + '.inner'), 'wb')
+                self.files[field]['inner'].write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def lookup(self, token):
+        if token not in self.token_dic:
+            self.token_dic[token] = len(self.token_dic)
+        return self.token_dic[token]
+
+    def write_field(self, field, value):
+        files, sizes = self.files[field], self.sizes[field]
+        if FIELDS[field] == 1:
+            files['data'].write(np.asarray(value, dtype=np.int32).tobytes())
+            sizes['data'] += len(value)
+            sizes['offsets'] = sizes['data']
+        else:
+            lengths = np.array([len(v) for v in value], dtype=np.int64)
+            if len(value) > 0:
+                files['data'].write(np.concatenate([np.asarray(v, dtype=np.int32) for v in value]).tobytes())
+            files['inner'].write((sizes['data'] + np.cumsum(lengths)).tobytes())
+            sizes['data'] += int(lengths.sum())
+            sizes['offsets'] += len(value)
+        files['offsets'].write(np.array([sizes['offsets']], dtype=np.int64).tobytes())
+
+    def write(self, data):
+        '''
+        :param data: the data dict after path_convert
+        :return:
+        '''
+        sample = dict(data)
+        sample['target'] = [self.lookup(word) for word in data['target']]
+        sample['content'] = [self.lookup(word) for word in data['content']]
+        sample['paths_map'] = list(data['paths_map'].values())
+        for field in FIELDS:
+            self.write_field(field, sample[field])
+        self.num += 1
+
+    def close(self):
+        for files in self.files.values():
+            for f in files.values():
+                f.close()
+        with open(os.path.join(self.save_dir, 'tokens.json'), 'w') as f:
+            json.dump(sorted(self.token_dic, key=self.token_dic.get), f)
+        with open(os.path.join(self.save_dir, 'meta.json'), 'w') as f:
+            json.dump({'num': self.num, 'fields': FIELDS}, f)
+
+
+class TextWriter:
+    def __init__(self, save_path, compress):
+        self.f = open(save_path, 'w')
+        self.compress = compress
+
+    def write(self, data):
+        self.f.write(self.compress(data) + '\n')
+
+    def close(self):
+        self.f.close()
+
+
+class JsonWriter:
+    def __init__(self, save_path):
+        self.f = open(save_path, 'w')
+
+    def write(self, data):
+        self.f.write(json.dumps(data) + '\n')
+
+    def close(self):
+        self.f.close()
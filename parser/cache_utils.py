@@ -0,0 +1,71 @@
+import os
+import json
+import zlib
+import sqlite3
+import hashlib
+
+CACHE_VERSION = 1  # bump it when the extraction in language_parse changes
+
+
+class ParseCache:
+    '''
+    Persistent cache of extract_record outputs, keyed by the hash of the code, the language and
+    the parser parameters that change the extraction (max_code_length and max_path_length do not).
+    It is a sqlite file, so the worker processes can share it, every process opens its own connection.
+    '''
+
+    def __init__(self, path, commit_every=256):
+        self.path = path
+        self.commit_every = commit_every
+        self.conn = None
+        self.pid = None
+        self.uncommitted = 0
+        self.hits, self.misses = 0, 0
+
+    def connect(self):
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout=600)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, value BLOB)')
+            self.pid = os.getpid()
+            self.uncommitted = 0
+        return self.conn
+
+    @staticmethod
+    def key(args, code):
+        params = json.dumps([CACHE_VERSION, args.language, args.punctuation])
+        return hashlib.sha1((params + '\n' + code).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        row = self.connect().execute('SELECT value FROM records WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def put(self, key, record):
+        value = zlib.compress(json.dumps(record).encode('utf-8'))
+        self.connect().execute('INSERT OR REPLACE INTO records VALUES (?, ?)', (key, value))
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.flush()
+
+    def count_into(self, count_dic):
+        '''
+        move the hits and misses since the last call into the count dic of the parse
+        '''
+        count_dic['cache_hits'] += self.hits
+        count_dic['cache_misses'] += self.misses
+        self.hits, self.misses = 0, 0
+
+    def flush(self):
+        if self.conn is not None and self.pid == os.getpid() and self.uncommitted > 0:
+            self.conn.commit()
+            self.uncommitted = 0
+
+
+def open_cache(args):
+    if args.cache_path == '':
+        return None
+    return ParseCache(args.cache_path)
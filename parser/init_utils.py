@@ -1,20 +1,74 @@
 from tree_sitter import Language, Parser
 import json
 import os
+import hashlib
 from tqdm import tqdm
 from token_utils import split_func_name
 
 
+VENDOR_DIR = '../vendor'
+BUILD_DIR = '../build'
+
+
+class GrammarRegistry:
+    '''
+    build every grammar once into build/<language>.so and load the languages lazily,
+    a library is only rebuilt when the sha1 of its grammar sources changes
+    '''
+
+    def __init__(self, vendor_dir=VENDOR_DIR, build_dir=BUILD_DIR):
+        self.vendor_dir = vendor_dir
+        self.build_dir = build_dir
+        self.languages = dict()
+
+    def grammar_dir(self, language):
+        return os.path.join(self.vendor_dir, 'tree-sitter-{}'.format(language))
+
+    def fingerprint(self, language):
+        sha1 = hashlib.sha1()
+        src_dir = os.path.join(self.grammar_dir(language), 'src')
+        for root, _, files in sorted(os.walk(src_dir)):
+            for file in sorted(files):
+                if os.path.splitext(file)[1] not in ['.c', '.cc', '.h']:
+                    continue
+                sha1.update(file.encode('utf-8'))
+                with open(os.path.join(root, file), 'rb') as f:
+                    sha1.update(f.read())
+        return sha1.hexdigest()
+
+    def build(self, language):
+        '''
+        :return: path of the library, compiled only if it is missing or its sources changed
+        '''
+        lib_path = os.path.join(self.build_dir, '{}.so'.format(language))
+        stamp_path = lib_path + '.sha1'
+        fingerprint = self.fingerprint(language)
+        if os.path.exists(lib_path) and os.path.exists(stamp_path):
+            with open(stamp_path, 'r') as f:
+                if f.read().strip() == fingerprint:
+                    return lib_path
+        if not os.path.exists(self.build_dir):
+            os.makedirs(self.build_dir)
+        print('Build {} grammar into {}'.format(language, lib_path))
+        tmp_path = '{}.{}.tmp'.format(lib_path, os.getpid())  # other processes never see a half written library
+        Language.build_library(tmp_path, [self.grammar_dir(language)])
+        os.replace(tmp_path, lib_path)
+        with open(stamp_path, 'w') as f:
+            f.write(fingerprint)
+        return lib_path
+
+    def get_language(self, language):
+        if language not in self.languages:
+            self.languages[language] = Language(self.build(language), language)
+        return self.languages[language]
+
+
+grammar_registry = GrammarRegistry()
+
+
 def init_parser(language):
-    Language.build_library(
-        '/home/zhangkechi/workspace/data/treesitter/build/{}.so'.format(language),
-        [
-            '/home/zhangkechi/workspace/data/treesitter/tree-sitter-{}'.format(language),
-        ]
-    )
-    language = Language('/home/zhangkechi/workspace/data/treesitter/build/{}.so'.format(language), language)
     lang_parser = Parser()
-    lang_parser.set_language(language)
+    lang_parser.set_language(grammar_registry.get_language(language))
     return lang_parser
 
 
@@ -31,9 +85,26 @@ def node_dict_init(language):
     return node_dic
 
 
+def grammar_node_dict(language):
+    '''
+    node dict taken from the symbol table of the grammar, so the ids do not depend on the corpus order
+    visible kinds are numbered in symbol order, a name shared by several symbols keeps its first id
+    :param language:
+    :return:
+    '''
+    ts_language = grammar_registry.get_language(language)
+    node_dic = dict()
+    for kind_id in range(ts_language.node_kind_count):
+        if ts_language.node_kind_is_visible(kind_id):
+            node_dic.setdefault(ts_language.node_kind_for_id(kind_id), len(node_dic))
+    node_dic.setdefault('ERROR', len(node_dic))
+    return node_dic
+
+
 def count_dict_init():
     count_dic = dict()
-    keys = ['tokens', 'uni_paths', 'paths', 'named', 'func', 'nums', 'uni_r_paths', 'max_row', 'path_len']
+    keys = ['tokens', 'uni_paths', 'paths', 'named', 'func', 'nums', 'uni_r_paths', 'max_row', 'path_len',
+            'cache_hits', 'cache_misses']
     for k in keys:
         count_dic[k] = 0
     return count_dic
@@ -57,3 +128,66 @@ def read_files(language, type):
                 all_data.append(data)
     print('Load {} {} files => {}'.format(language, type, len(all_data)))
     return all_data
+
+
+def read_records(file_path, jsonl=None, buffer_size=1 << 20):
+    '''
+    lazily yield records from a jsonl file or from a file holding one json array,
+    only <buffer_size> chars of the file are kept in memory
+    :param file_path:
+    :param jsonl: one record per line, None to decide by the .jsonl extension
+    :param buffer_size:
+    :return:
+    '''
+    if jsonl is None:
+        jsonl = file_path.endswith('.jsonl')
+    with open(file_path, 'r') as f:
+        if jsonl:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        head = f.read(1)
+        while head.isspace():
+            head = f.read(1)
+        if head != '[':
+            raise Exception('{} is not a json array, use --jsonl for one record per line'.format(file_path))
+        decoder = json.JSONDecoder()
+        buffer, pos, eof = '', 0, False
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ','):
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                rest = buffer[pos + 1:]
+                while not rest.strip():
+                    rest = f.read(buffer_size)
+                    if not rest:
+                        break
+                if rest.strip():
+                    raise Exception('{} has data after the json array, use --jsonl for one record per line'.format(
+                        file_path))
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+                if end < len(buffer) or eof:  # a bare number may be cut at the buffer border
+                    yield record
+                    pos = end
+                    continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            chunk = f.read(buffer_size)
+            eof = len(chunk) == 0
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+
+def chunk_records(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
@@ -1,15 +1,24 @@
 import argparse
 import os
+import sys
 import itertools
 from tqdm import tqdm
 import attr
 import random
-from multiprocessing import Process
+import zlib
+from multiprocessing import Process, Pool
+from functools import partial
+from collections import deque, Counter
 import json
+import shutil
 import numpy as np
-from init_utils import init_parser, count_dict_init, node_dict_init, read_files
-from statistic import data_count, token_statistic, update_sum_dict
-from path_utils import path_convert, paths_to_idx, merge_terminals2_paths, save_path
+from init_utils import init_parser, count_dict_init, node_dict_init, read_files, read_records, chunk_records, \
+    grammar_registry, grammar_node_dict
+from statistic import data_count, token_statistic, update_sum_dict, update_count_dict, save_count_shard
+from path_utils import path_convert, fixed_path_convert, paths_to_idx, merge_terminals2_paths, save_path, NodeTable, \
+    extract_paths
+from binary_utils import BinaryWriter, TextWriter, JsonWriter
+from cache_utils import open_cache
 from token_utils import split_identifier_into_parts, is_number, is_punctuation, judge_func
 
 identifier_type = {
@@ -50,6 +59,7 @@ class MyNode:
     named = attr.ib()
     idx = attr.ib()
     row = attr.ib()
+    leaf = attr.ib(default=-1)  # position of the source leaf in the dfs order
 
 
 def boolean_string(s):
@@ -58,64 +68,111 @@ def boolean_string(s):
     return s == 'True'
 
 
-def clean_convert_split(args, paths, code):
+def convert_terminal(args, terminal, data_lines):
+    '''
+    convert a leaf of the tree into code tokens
+    :return: a list of (token, keep_leaf), keep_leaf is False when the token replaces the leaf node in its path
+    '''
+    l_, r_ = terminal.start_point, terminal.end_point
+    if terminal.type in string_type[args.language]:
+        return [('<{}>'.format('STR'), True)]
+    # if l_[0] != r_[0]:
+    #     print(terminal)
+    assert l_[0] == r_[0]  # assert at same line
+    literal = data_lines[l_[0]][l_[1]: r_[1]]
+    blocks = split_identifier_into_parts(literal)
+    if False:  # this is func name
+        pass
+    elif terminal.type in identifier_type[args.language]:
+        return [(block, True) for block in blocks]
+    elif is_number(literal) or terminal.type in ['decimal_integer_literal',
+                                                 'decimal_floating_point_literal',
+                                                 'hex_integer_literal', 'integer',
+                                                 'float', 'int_literal', 'imaginary_literal', 'float_literal']:
+        return [('<{}>'.format('NUM'), True)]
+    elif not args.punctuation and is_punctuation(literal):
+        return []
+    else:
+        return [(terminal.type, False)]
+
+
+def clean_convert_split(args, paths, code, max_code_length=None):
+    if max_code_length is None:
+        max_code_length = args.max_code_length
     data_lines = code.splitlines()
     temp_paths = []
-    func_name = []
     count = 0
-    get_func = False
     for idx, path in enumerate(paths):
-        if count >= args.max_code_length:
+        if count >= max_code_length:
             break
         terminal = path[-1]
-        l_, r_ = terminal.start_point, terminal.end_point
-        if terminal.type in string_type[args.language]:
-            new_node = MyNode('<{}>'.format('STR'), terminal.is_named, count, int(l_[0]))
+        for token, keep_leaf in convert_terminal(args, terminal, data_lines):
+            new_node = MyNode(token, terminal.is_named, count, int(terminal.start_point[0]), idx)
             count += 1
-            temp_paths.append(path + [new_node])
-        else:
-            # if l_[0] != r_[0]:
-            #     print(terminal)
-            assert l_[0] == r_[0]  # assert at same line
-            literal = data_lines[l_[0]][l_[1]: r_[1]]
-            blocks = split_identifier_into_parts(literal)
-            if False:  # this is func name
-                pass
-            elif terminal.type in identifier_type[args.language]:
-                for block in blocks:
-                    new_node = MyNode(block, terminal.is_named, count, int(l_[0]))
-                    count += 1
-                    temp_paths.append(path + [new_node])
-            elif is_number(literal) or terminal.type in ['decimal_integer_literal',
-                                                         'decimal_floating_point_literal',
-                                                         'hex_integer_literal', 'integer',
-                                                         'float', 'int_literal', 'imaginary_literal', 'float_literal']:
-                new_node = MyNode('<{}>'.format('NUM'), terminal.is_named, count, int(l_[0]))
-                count += 1
-                temp_paths.append(path + [new_node])
-            elif not args.punctuation and is_punctuation(literal):
-                continue
-            else:
-                new_node = MyNode(terminal.type, terminal.is_named, count, int(l_[0]))
-                count += 1
-                temp_paths.append(path[:-1] + [new_node])
-    # if not get_func:
-    #     print(code)
-    return temp_paths[:args.max_code_length]
-
-
-def language_parse(args, data, lang_parser):
-    code = data[1]
-    # code, f_name = data['code'], data['func_name']
-    tree = lang_parser.parse(bytes(code, "utf-8"))
+            temp_paths.append((path if keep_leaf else path[:-1]) + [new_node])
+    return temp_paths[:max_code_length]
+
+
+def clean_convert_split_ids(args, table, leaves, code, max_code_length=None):
+    '''
+    integer id version of clean_convert_split, the terminals are added into the table
+    :param args:
+    :param table:
+    :param leaves: (leaf node, leaf id) pairs from walk_leaves
+    :param code:
+    :param max_code_length:
+    :return: terminals and their ids in the table
+    '''
+    if max_code_length is None:
+        max_code_length = args.max_code_length
+    data_lines = code.splitlines()
+    terminals, terminal_ids = [], []
+    for idx, (terminal, leaf_id) in enumerate(leaves):
+        if len(terminals) >= max_code_length:
+            break
+        for token, keep_leaf in convert_terminal(args, terminal, data_lines):
+            terminals.append(MyNode(token, terminal.is_named, len(terminals), int(terminal.start_point[0]), idx))
+            terminal_ids.append(table.add(token, leaf_id if keep_leaf else table.parents[leaf_id]))
+    return terminals[:max_code_length], terminal_ids[:max_code_length]
+
+
+def walk_leaves(tree, table, leaf_limit=None):
+    '''
+    non-recursive preorder walk with the tree cursor, every visited node is added into the table
+    :param tree:
+    :param table: NodeTable
+    :param leaf_limit: stop right after this num of leaves, None for the whole tree
+    :return: (leaf node, leaf id) pairs in the dfs order
+    '''
+    cursor = tree.walk()
+    leaves = []
+    stack = [table.add(cursor.node.type, -1)]
+    while True:
+        if cursor.goto_first_child():
+            stack.append(table.add(cursor.node.type, stack[-1]))
+            continue
+        leaves.append((cursor.node, stack[-1]))
+        if leaf_limit is not None and len(leaves) >= leaf_limit:
+            return leaves
+        while not cursor.goto_next_sibling():
+            if not cursor.goto_parent():
+                return leaves
+            stack.pop()
+        stack[-1] = table.add(cursor.node.type, stack[-2])
+
+
+def collect_leaf_paths(tree, leaf_limit=None):
+    '''
+    dfs the tree and collect the root-to-leaf node paths
+    :param tree:
+    :param leaf_limit: stop after this num of leaves, None for the whole tree
+    :return:
+    '''
     stack, paths = [], []
-    paths_map = dict()
-    root_path_pool = []
-    path_pool = []
 
     def dfs(node):
         stack.append(node)
-        if len(paths) > args.max_code_length * 1.5:  # avoid no need dfs
+        if leaf_limit is not None and len(paths) >= leaf_limit:  # avoid no need dfs
             return
         if node.child_count == 0:
             paths.append(stack.copy())
@@ -126,9 +183,74 @@ def language_parse(args, data, lang_parser):
 
     cursor = tree.walk()
     dfs(cursor.node)
+    return paths
+
+
+def get_leaf_limit(args):
+    return int(args.max_code_length * 1.5) + 1
+
+
+def extract_record(args, code, lang_parser, leaf_limit=None, max_code_length=sys.maxsize):
+    '''
+    parse the code into an integer node table and its terminals, the record is json serializable
+    and with the default limits it does not depend on max_code_length and max_path_length
+    :param args:
+    :param code:
+    :param lang_parser:
+    :param leaf_limit:
+    :param max_code_length:
+    :return:
+    '''
+    tree = lang_parser.parse(bytes(code, "utf-8"))
+    table = NodeTable()
+    leaves = walk_leaves(tree, table, leaf_limit)
+    terminals, terminal_ids = clean_convert_split_ids(args, table, leaves, code, max_code_length)
+    return {'types': table.types, 'parents': table.parents, 'terminal_ids': terminal_ids,
+            'tokens': [node.type for node in terminals], 'named': [int(node.named) for node in terminals],
+            'rows': [int(node.row) for node in terminals], 'leaves': [node.leaf for node in terminals]}
+
+
+def record_to_sample(args, record, code):
+    '''
+    apply the max_code_length / max_path_length / max_path_num truncation to a record
+    :return: the same outputs as language_parse
+    '''
+    leaf_limit = get_leaf_limit(args)
+    keep = [k for k, leaf in enumerate(record['leaves']) if leaf < leaf_limit][:args.max_code_length]
+    table = NodeTable.from_arrays(record['types'], record['parents'])
+    terminal_ids = [record['terminal_ids'][k] for k in keep]
+    rng = random.Random(zlib.crc32(code.encode('utf-8'))) if args.pair_policy == 'random' else None
+    path_pool, paths_map, r_path_idx, root_path_pool = extract_paths(table, terminal_ids, args.max_path_length,
+                                                                     args.max_path_num, args.pair_policy, rng,
+                                                                     args.stop_at_budget)
+    return path_pool, [record['tokens'][k] for k in keep], [record['named'][k] for k in keep], \
+           paths_map, [record['rows'][k] + 1 for k in keep], r_path_idx, root_path_pool
+
+
+def language_parse(args, data, lang_parser, cache=None):
+    code = data[1]
+    # code, f_name = data['code'], data['func_name']
+    if cache is not None:
+        assert args.lca_engine, 'parse cache needs the lca engine'
+        key = cache.key(args, code)
+        record = cache.get(key)
+        if record is None:
+            record = extract_record(args, code, lang_parser)
+            cache.put(key, record)
+        return record_to_sample(args, record, code)
+    if args.lca_engine:
+        record = extract_record(args, code, lang_parser, get_leaf_limit(args), args.max_code_length)
+        return record_to_sample(args, record, code)
+
+    tree = lang_parser.parse(bytes(code, "utf-8"))
+    paths_map = dict()
+    root_path_pool = []
+    path_pool = []
+    paths = collect_leaf_paths(tree, get_leaf_limit(args))
     paths = clean_convert_split(args, paths, code)
-    r_path_idx = paths_to_idx(paths, root_path_pool)
     terminals = [path[-1] for path in paths]
+    assert args.max_path_num <= 0, 'path budget needs the lca engine'
+    r_path_idx = paths_to_idx(paths, root_path_pool)
     combinations = itertools.combinations(iterable=paths, r=2)
     for v_path, u_path in combinations:
         l_node, prefix, path, suffix, r_node = merge_terminals2_paths(v_path, u_path)
@@ -146,24 +268,127 @@ def language_parse(args, data, lang_parser):
            paths_map, [int(node.row) + 1 for node in terminals], r_path_idx, root_path_pool
 
 
+def parse_record(args, data, lang_parser, cache=None):
+    cls_idx = data[0]
+    paths, code_tokens, code_named, paths_map, row, r_path_idx, r_paths = \
+        language_parse(args, data, lang_parser, cache)
+    return {'target': str(cls_idx),
+            'content': code_tokens, 'named': code_named,
+            'paths': paths, 'paths_map': paths_map, 'row': row, 'r_path_idx': r_path_idx, 'r_paths': r_paths
+            }
+
+
+def fixed_node_dict(args):
+    '''
+    node dict that is known before parsing: the frozen node vocab, or the symbol table of the grammar
+    :param args:
+    :return: None if the node ids are assigned in the merge step by corpus order
+    '''
+    if args.frozen_node_vocab != '':
+        with open(args.frozen_node_vocab, 'r') as f:
+            return json.loads(f.readline())
+    if args.node_ids == 'grammar':
+        return grammar_node_dict(args.language)
+    return None
+
+
+def writes_shards(args):
+    '''
+    with fixed node ids the workers write final text shards, and the merge step only concatenates them
+    '''
+    return args.output_format == 'text' and (args.frozen_node_vocab != '' or args.node_ids == 'grammar')
+
+
 def sub_process(args, idx, all_data, lang_parser):
-    save_path = os.path.join('../data', args.language, '{}_{}.json'.format(args.type, idx))
-    source_dic, target_dic = dict(), dict()
-    with open(save_path, 'w') as f:
-        for data in tqdm(all_data):
-            cls_idx = data[0]
-            paths, code_tokens, code_named, paths_map, row, r_path_idx, r_paths = \
-                language_parse(args, data, lang_parser)
-            token_statistic(source_dic, target_dic, code_tokens, str(cls_idx))
-            data = {'target': str(cls_idx),
-                    'content': code_tokens, 'named': code_named,
-                    'paths': paths, 'paths_map': paths_map, 'row': row, 'r_path_idx': r_path_idx, 'r_paths': r_paths
-                    }
-            f.write(json.dumps(data) + '\n')
+    node_dic = fixed_node_dict(args)
+    if writes_shards(args):
+        writer = TextWriter(os.path.join('../data', args.language, '{}_{}.txt'.format(args.type, idx)), compress)
+    else:
+        writer = JsonWriter(os.path.join('../data', args.language, '{}_{}.json'.format(args.type, idx)))
+    source_dic, target_dic = Counter(), Counter()
+    count_dic = count_dict_init()
+    cache = open_cache(args)
+    for data in tqdm(all_data):
+        data = parse_record(args, data, lang_parser, cache)
+        token_statistic(source_dic, target_dic, data['content'], data['target'])
+        if node_dic is not None:
+            data = merge_data(data, count_dic, node_dic, fixed=True)
+        writer.write(data)
+    writer.close()
+    if cache is not None:
+        cache.flush()
+        cache.count_into(count_dic)
     dict_save_path = os.path.join('../data', args.language, '{}_dict_{}.json'.format(args.type, idx))
     with open(dict_save_path, 'w') as f:
         f.write(json.dumps(source_dic) + '\n')
         f.write(json.dumps(target_dic) + '\n')
+        f.write(json.dumps(count_dic) + '\n')
+
+
+_worker_parser = None
+_worker_cache = None
+_worker_node_dic = None
+
+
+def init_worker(args):
+    '''
+    build the tree sitter parser and the cache connection once per pool worker
+    :param args:
+    :return:
+    '''
+    global _worker_parser, _worker_cache, _worker_node_dic
+    _worker_parser = init_parser(args.language)
+    _worker_cache = open_cache(args)
+    _worker_node_dic = fixed_node_dict(args)
+
+
+def parse_chunk(args, chunk):
+    '''
+    parse a chunk of raw records inside a pool worker
+    :param args:
+    :param chunk: list of raw records
+    :return: parsed records, the token counts and the data counts of this chunk
+             the paths are already converted if the node ids are fixed
+    '''
+    results, source_dic, target_dic = [], Counter(), Counter()
+    count_dic = count_dict_init()
+    for data in chunk:
+        data = parse_record(args, data, _worker_parser, _worker_cache)
+        token_statistic(source_dic, target_dic, data['content'], data['target'])
+        if _worker_node_dic is not None:
+            data = merge_data(data, count_dic, _worker_node_dic, fixed=True)
+        results.append(data)
+    if _worker_cache is not None:
+        _worker_cache.flush()
+        _worker_cache.count_into(count_dic)
+    return results, source_dic, target_dic, count_dic
+
+
+def ordered_imap(pool, func, iterable, window):
+    '''
+    like pool.imap, but at most <window> tasks are in flight, so the input is consumed lazily
+    idle workers take the next pending chunk, and results are yielded in input order
+    :param pool:
+    :param func:
+    :param iterable:
+    :param window:
+    :return:
+    '''
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def merge_data(data, count_dic, node_dic, fixed=False):
+    convert = fixed_path_convert if fixed else path_convert
+    data_count(data, count_dic)
+    data['paths'] = convert(data['paths'], node_dic)
+    data['r_paths'] = convert(data['r_paths'], node_dic)
+    return data
 
 
 def compress(data):
@@ -179,12 +404,20 @@ def compress(data):
     return s
 
 
+def open_writer(args):
+    if args.output_format == 'binary':
+        return BinaryWriter(os.path.join('../data', args.language, '{}_bin'.format(args.type)))
+    return TextWriter(os.path.join('../data', args.language, '{}.txt'.format(args.type)), compress)
+
+
 def process(args):
     lang_parser = init_parser(args.language)
     if not os.path.exists('../data/{}'.format(args.language)):
         os.makedirs('../data/{}'.format(args.language))
-    source_dic, target_dic = dict(), dict()
-    node_dic = node_dict_init(args.language)
+    source_dic, target_dic = Counter(), Counter()
+    node_dic = fixed_node_dict(args)
+    fixed = node_dic is not None
+    if not fixed: node_dic = node_dict_init(args.language)
     count_dic = count_dict_init()
     # all_data = read_files(args.language, args.type)
     # all_data = read_files(args.file_path)
@@ -206,20 +439,25 @@ def process(args):
     else:
         sub_process(args, 0, all_data, lang_parser)
 
-    print('Sub Files Merge')
-    sum_save_path = os.path.join('../data', args.language, '{}.txt'.format(args.type))
-    with open(sum_save_path, 'w') as f:
+    if writes_shards(args):
+        print('Sub Files Concat')
+        with open(os.path.join('../data', args.language, '{}.txt'.format(args.type)), 'w') as f:
+            for i in range(args.process_num):
+                sub_save_path = os.path.join('../data', args.language, '{}_{}.txt'.format(args.type, i))
+                with open(sub_save_path, 'r') as l:
+                    shutil.copyfileobj(l, f)
+                os.remove(sub_save_path)
+    else:
+        print('Sub Files Merge')
+        writer = open_writer(args)
         for i in range(args.process_num):
             sub_save_path = os.path.join('../data', args.language, '{}_{}.json'.format(args.type, i))
             with open(sub_save_path, 'r') as l:
-                lines = l.readlines()
-                for line in lines:
+                for line in l:
                     data = json.loads(line)
-                    data_count(data, count_dic)
-                    data['paths'] = path_convert(data['paths'], node_dic)
-                    data['r_paths'] = path_convert(data['r_paths'], node_dic)
-                    f.write(compress(data) + '\n')
+                    writer.write(data if fixed else merge_data(data, count_dic, node_dic))
             os.remove(sub_save_path)
+        writer.close()
 
     print('Sub Dict Concat')
     for i in range(args.process_num):
@@ -227,14 +465,59 @@ def process(args):
         try:
             with open(sub_dict_path, 'r') as f:
                 lines = f.readlines()
-                assert len(lines) == 2
+                assert len(lines) == 3
                 sub_source_dic = json.loads(lines[0])
                 sub_target_dic = json.loads(lines[1])
                 update_sum_dict(sub_source_dic, sub_target_dic, source_dic, target_dic)
+                update_count_dict(json.loads(lines[2]), count_dic)
             os.remove(sub_dict_path)
         except FileNotFoundError:
             continue
 
+    summary(args, count_dic, source_dic, target_dic, node_dic)
+
+
+def stream_process(args):
+    '''
+    streaming version of process: records are read lazily and parsed chunk by chunk in a worker pool,
+    so the peak memory is bounded by chunk_size * process_num instead of the corpus size
+    '''
+    assert not args.shuffle, 'stream mode keeps the input order, please shuffle the raw file in advance'
+    if not os.path.exists('../data/{}'.format(args.language)):
+        os.makedirs('../data/{}'.format(args.language))
+    source_dic, target_dic = Counter(), Counter()
+    node_dic = fixed_node_dict(args)
+    fixed = node_dic is not None
+    if not fixed: node_dic = node_dict_init(args.language)
+    count_dic = count_dict_init()
+    records = read_records(args.file_path, args.jsonl)
+    if args.nums > 0: records = itertools.islice(records, args.nums)
+    chunks = chunk_records(records, args.chunk_size)
+    worker = partial(parse_chunk, args)
+
+    grammar_registry.build(args.language)  # build once before the workers start
+    pool = Pool(args.process_num, initializer=init_worker, initargs=(args,)) if args.process_num > 1 else None
+    if pool is None:
+        init_worker(args)
+        results = map(worker, chunks)
+    else:
+        results = ordered_imap(pool, worker, chunks, window=args.process_num * 2)
+    writer = open_writer(args)
+    try:
+        for chunk_data, sub_source_dic, sub_target_dic, sub_count_dic in tqdm(results):
+            for data in chunk_data:
+                writer.write(data if fixed else merge_data(data, count_dic, node_dic))
+            update_sum_dict(sub_source_dic, sub_target_dic, source_dic, target_dic)
+            update_count_dict(sub_count_dic, count_dic)
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    summary(args, count_dic, source_dic, target_dic, node_dic)
+
+
+def summary(args, count_dic, source_dic, target_dic, node_dic):
     print('avg_tokens:{}'.format(count_dic['tokens'] / count_dic['nums']))
     print('avg_comment_tokens:{}'.format(count_dic['func'] / count_dic['nums']))
     print('avg_uni_undirected_paths:{}'.format(count_dic['uni_paths'] / count_dic['nums']))
@@ -248,6 +531,12 @@ def process(args):
     print('source_vocab:{}'.format(len(source_dic)))
     print('target_vocab:{}'.format(len(target_dic)))
     print('node_vocab:{}'.format(len(node_dic)))
+    if args.cache_path != '':
+        print('parse_cache_hits:{}, misses:{}'.format(count_dic['cache_hits'], count_dic['cache_misses']))
+    save_count_shard('../data/{}/counts/{}.json'.format(args.language, args.type), source_dic, target_dic)
+    if args.frozen_node_vocab != '' or args.node_ids == 'grammar':
+        # unknown node types of a frozen vocab take the id len(node_dic)
+        print('path_embedding_num should be at least {}'.format(len(node_dic) + 1))
     if args.type == 'train' or args.save_vocab:
         print('Save Text Vocab')
         with open('../data/{}/source_vocab.json'.format(args.language), 'w') as f:
@@ -271,6 +560,37 @@ if __name__ == '__main__':
     parser.add_argument('--process_num', type=int, default=8)
     parser.add_argument('--save_vocab', type=boolean_string, default=True)
     parser.add_argument('--shuffle', type=boolean_string, default=False)
+    parser.add_argument('--max_path_num', type=int, default=-1,
+                        help='budget of unique relative paths per snippet (same as the dataset), -1 for all pairs. '
+                             'Without --stop_at_budget every pair is still visited, so the time stays quadratic '
+                             'in the token num and only the output is bounded')
+    parser.add_argument('--pair_policy', choices=['first', 'nearest', 'random'], type=str, default='first',
+                        help='the order to enumerate terminal pairs when max_path_num is set; nearest takes the pairs '
+                             'with a small position gap first, a cheap stand-in for shortest paths first, which would '
+                             'need the path of every pair up front')
+    parser.add_argument('--stop_at_budget', type=boolean_string, default=False,
+                        help='stop the pair enumeration at the first new path out of max_path_num, so the time scales '
+                             'with the budget, but the later pairs of the kept paths are dropped, unlike the '
+                             'max_path_num cut of the dataset')
+    parser.add_argument('--lca_engine', type=boolean_string, default=True,
+                        help='extract paths on integer node ids instead of node lists, the output is the same')
+    parser.add_argument('--cache_path', type=str, default='',
+                        help='sqlite file caching the parsed trees by code hash, re-runs only parse new snippets')
+    parser.add_argument('--output_format', choices=['text', 'binary'], type=str, default='text',
+                        help='text: <type>.txt lines; binary: memory-mapped arrays in the <type>_bin dir')
+    parser.add_argument('--stream', type=boolean_string, default=False,
+                        help='read the raw file (jsonl or json array) lazily and parse it chunk by chunk')
+    parser.add_argument('--jsonl', type=boolean_string, default=None,
+                        help='the raw file has one record per line, by default only for the .jsonl extension')
+    parser.add_argument('--chunk_size', type=int, default=256, help='records per task in stream mode')
+    parser.add_argument('--node_ids', choices=['corpus', 'grammar'], type=str, default='corpus',
+                        help='corpus: node ids by first occurrence in the merge step; '
+                             'grammar: ids from the symbol table, the workers write final shards')
+    parser.add_argument('--frozen_node_vocab', type=str, default='',
+                        help='a saved node_vocab.json to map the node types, it overrides --node_ids')
     args = parser.parse_args()
     print(args)
-    process(args)
+    if args.stream:
+        stream_process(args)
+    else:
+        process(args)
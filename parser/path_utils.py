@@ -1,4 +1,5 @@
 from typing import List
+import numpy as np
 
 
 def merge_terminals2_paths(v_path, u_path):
@@ -64,3 +65,217 @@ def path_convert(paths, node_dic) -> List[List]:
             temp_p.append(lookup(node_dic, node))
         temp_path.append(temp_p)
     return temp_path
+
+
+def fixed_path_convert(paths, node_dic) -> List[List]:
+    '''
+    convert word in paths to idx with a fixed node dict, which is never updated,
+    so the workers can convert their own paths; unknown types share the id len(node_dic)
+    :param paths:
+    :param node_dic:
+    :return:
+    '''
+    unk = len(node_dic)
+    return [[node_dic.get(node, unk) for node in p] for p in paths]
+
+
+class NodeTable:
+    '''
+    integer id view of the parsed tree, node i has type types[i], parent parents[i] (-1 for root) and depth depths[i]
+    '''
+
+    def __init__(self):
+        self.types = []
+        self.parents = []
+        self.depths = []
+
+    def add(self, node_type, parent):
+        self.types.append(node_type)
+        self.parents.append(parent)
+        self.depths.append(0 if parent < 0 else self.depths[parent] + 1)
+        return len(self.types) - 1
+
+    def __len__(self):
+        return len(self.types)
+
+    @classmethod
+    def from_arrays(cls, types, parents):
+        '''
+        rebuild the table from saved types and parents, parents always have smaller ids
+        '''
+        table = cls()
+        for node_type, parent in zip(types, parents):
+            table.add(node_type, parent)
+        return table
+
+    @classmethod
+    def from_paths(cls, paths):
+        '''
+        build the table from root-to-terminal node paths, nodes are shared by identity like merge_terminals2_paths
+        :param paths:
+        :return: table, ids of the terminals
+        '''
+        table = cls()
+        node_ids = dict()
+        terminal_ids = []
+        for path in paths:
+            parent = -1
+            for node in path:
+                key = id(node)
+                if key not in node_ids:
+                    node_ids[key] = table.add(node.type, parent)
+                parent = node_ids[key]
+            terminal_ids.append(parent)
+        return table, terminal_ids
+
+
+class PathInterner:
+    '''
+    hash keyed replacement of save_path, pool keeps the insertion order
+    '''
+
+    def __init__(self):
+        self.pool = []
+        self.index = dict()
+
+    def save(self, path):
+        key = tuple(path)
+        idx = self.index.get(key)
+        if idx is None:
+            idx = len(self.pool)
+            self.index[key] = idx
+            self.pool.append(list(path))
+        return idx
+
+    def __contains__(self, path):
+        return tuple(path) in self.index
+
+    def __len__(self):
+        return len(self.pool)
+
+
+def merge_terminals2_ids(table, l_id, r_id):
+    '''
+    integer id version of merge_terminals2_paths, the lca is found by climbing the parent array
+    :param table:
+    :param l_id:
+    :param r_id:
+    :return: node ids from the parent of l_id, up to the lca, and down to the parent of r_id
+    '''
+    parents, depths = table.parents, table.depths
+    u, v = parents[l_id], parents[r_id]
+    prefix, suffix = [], []
+    while depths[u] > depths[v]:
+        prefix.append(u)
+        u = parents[u]
+    while depths[v] > depths[u]:
+        suffix.append(v)
+        v = parents[v]
+    while u != v:
+        prefix.append(u)
+        suffix.append(v)
+        u, v = parents[u], parents[v]
+    suffix.reverse()
+    return prefix + [u] + suffix
+
+
+def root_paths_to_idx(table, terminal_ids, interner):
+    '''
+    integer id version of paths_to_idx, the root path of every node is built once from its parent
+    :param table:
+    :param terminal_ids:
+    :param interner:
+    :return:
+    '''
+    root_paths = [None] * len(table)
+
+    def root_path(node):
+        chain = []
+        while node >= 0 and root_paths[node] is None:
+            chain.append(node)
+            node = table.parents[node]
+        prefix = root_paths[node] if node >= 0 else ()
+        for n in reversed(chain):
+            prefix = prefix + (table.types[n],)
+            root_paths[n] = prefix
+        return prefix
+
+    return [interner.save(root_path(table.parents[t])) for t in terminal_ids]
+
+
+def lazy_permutation(n, rng):
+    '''
+    yield a random permutation of range(n) one by one, the cost is proportional to the taken items
+    '''
+    swaps = dict()
+    for i in range(n):
+        j = rng.randrange(i, n)
+        yield swaps.get(j, j)
+        swaps[j] = swaps.get(i, i)
+
+
+def pair_order(n, policy='first', rng=None):
+    '''
+    enumerate the terminal pairs (i, j), i < j
+    :param n: terminal num
+    :param policy: first: the order of itertools.combinations; nearest: pairs with small position gap first,
+                   which usually have short paths; random: uniform random order
+    :param rng: random.Random for the random policy
+    :return:
+    '''
+    if policy == 'first':
+        for i in range(n):
+            for j in range(i + 1, n):
+                yield i, j
+    elif policy == 'nearest':
+        for gap in range(1, n):
+            for i in range(n - gap):
+                yield i, i + gap
+    elif policy == 'random':
+        for k in lazy_permutation(n * n, rng):
+            i, j = divmod(k, n)
+            if i < j:
+                yield i, j
+    else:
+        raise Exception('Not Valid Pair Policy !')
+
+
+def extract_paths(table, terminal_ids, max_path_length, max_path_num=-1, pair_policy='first', rng=None,
+                  stop_at_budget=False):
+    '''
+    pairwise relative paths and absolute paths of the terminals
+    :param table:
+    :param terminal_ids:
+    :param max_path_length: longer paths are sampled uniformly
+    :param max_path_num: budget of unique paths, the pairs of a new path out of budget are skipped (as the dataset
+                         does), the pairs of the kept paths are still mapped; -1 for no budget
+    :param pair_policy: see pair_order
+    :param rng:
+    :param stop_at_budget: stop the enumeration at the first new path out of budget instead, so the time scales
+                           with the budget, but the later pairs of the kept paths are dropped from the paths map
+    :return: path pool, paths map, r_path_idx, root path pool
+    '''
+    root_interner = PathInterner()
+    r_path_idx = root_paths_to_idx(table, terminal_ids, root_interner)
+    interner = PathInterner()
+    paths_map = dict()
+    sample_idx = dict()
+    types = table.types
+    for i, j in pair_order(len(terminal_ids), pair_policy, rng):
+        path = merge_terminals2_ids(table, terminal_ids[i], terminal_ids[j])
+        if len(path) > max_path_length:
+            if len(path) not in sample_idx:
+                sample_idx[len(path)] = np.linspace(0, len(path) - 1, max_path_length, dtype=int).tolist()
+            path = [path[k] for k in sample_idx[len(path)]]
+        path = [types[node] for node in path]
+        if 0 < max_path_num <= len(interner) and path not in interner:
+            if stop_at_budget:
+                break
+            continue
+        path_idx = interner.save(path)
+        if path_idx in paths_map:
+            paths_map[path_idx].append(i)
+            paths_map[path_idx].append(j)
+        else:
+            paths_map[path_idx] = [i, j]
+    return interner.pool, paths_map, r_path_idx, root_interner.pool
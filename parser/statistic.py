@@ -1,18 +1,15 @@
+import os
+import json
+from collections import Counter
 from typing import List, Dict
 
 
-def token_statistic(source_dic: Dict, target_dic: Dict, source: List, target: List):
-    def lookup_update(dic, item):
-        if item in dic:
-            dic[item] += 1
-        else:
-            dic[item] = 1
-        return list(dic.keys()).index(item)
-
-    for token in source:
-        _ = lookup_update(source_dic, token)
-    for token in target:
-        _ = lookup_update(target_dic, token)
+def token_statistic(source_dic: Counter, target_dic: Counter, source: List, target: List):
+    '''
+    count the tokens of one sample, O(1) per token
+    '''
+    source_dic.update(source)
+    target_dic.update(target)
 
 
 def data_count(data, count_dic):
@@ -44,10 +41,65 @@ def update_sum_dict(sub_source_dic, sub_target_dic, source_dic, target_dic):
 
     def update_dict(sub_dic, dic):
         for key, value in sub_dic.items():
-            if key in dic:
-                dic[key] += value
-            else:
-                dic[key] = value
+            dic[key] = dic.get(key, 0) + value
 
     update_dict(sub_source_dic, source_dic)
     update_dict(sub_target_dic, target_dic)
+
+
+def update_count_dict(sub_count_dic, count_dic):
+    '''
+    merge the data_count statistics of a worker into the whole count dic
+    :param sub_count_dic:
+    :param count_dic:
+    :return:
+    '''
+    for key, value in sub_count_dic.items():
+        if key == 'max_row':
+            count_dic[key] = max(count_dic[key], value)
+        else:
+            count_dic[key] += value
+
+
+def save_count_shard(path, source_dic, target_dic):
+    '''
+    persist the raw token counts, so vocabularies with other cut-offs can be built without re-parsing
+    '''
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(json.dumps(source_dic) + '\n')
+        f.write(json.dumps(target_dic) + '\n')
+
+
+def load_count_shards(paths):
+    '''
+    merge the count shards in order
+    :param paths:
+    :return: source counter, target counter
+    '''
+    source_dic, target_dic = Counter(), Counter()
+    for path in paths:
+        with open(path, 'r') as f:
+            update_sum_dict(json.loads(f.readline()), json.loads(f.readline()), source_dic, target_dic)
+    return source_dic, target_dic
+
+
+def cut_vocab(count_dic, min_freq=1, portion=1.0):
+    '''
+    keep the most frequent tokens with the rules of dataset/vocab.py:
+    stop at the first token whose count < min_freq (UniTextVocab, on the merged source and target counts),
+    or whose cumulative count exceeds portion of all tokens (TextVocab)
+    :param count_dic: {token: count}
+    :param min_freq:
+    :param portion:
+    :return: {token: count} ordered by count
+    '''
+    sum_tokens = sum(count_dic.values())
+    vocab, temp_sum = dict(), 0
+    for key, value in sorted(count_dic.items(), key=lambda item: item[1], reverse=True):
+        temp_sum += value
+        if value < min_freq or temp_sum / sum_tokens > portion:
+            break
+        vocab[key] = value
+    return vocab
@@ -0,0 +1,56 @@
+import argparse
+import os
+import json
+from statistic import load_count_shards, cut_vocab
+
+'''
+Build the source/target vocab files from the count shards saved by multi_language_parser.py,
+e.g. over several splits, without re-parsing:
+
+python vocab_builder.py --language python --types train valid --output_dir ../data/python_train_valid
+
+The full counts are written, the cut-off is left to dataset/vocab.py (vocab_threshold, s_vocab_portion,
+t_vocab_portion), so the same args give the same vocab as with the files of the parser.
+The vocab sizes these args lead to are printed, to pick them without loading the dataset.
+'''
+
+
+def boolean_string(s):
+    if s not in {'False', 'True'}:
+        raise ValueError('Not a valid boolean string')
+    return s == 'True'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--language', choices=['python', 'javascript', 'java', 'cpp', 'ruby', 'go'], type=str,
+                        default='python')
+    parser.add_argument('--types', nargs='+', type=str, default=['train'], help='the count shards to merge')
+    parser.add_argument('--uni_vocab', type=boolean_string, default=True, help='same as uni_vocab of the dataset')
+    parser.add_argument('--vocab_threshold', type=int, default=100,
+                        help='same as vocab_threshold of UniTextVocab, only for the printed size')
+    parser.add_argument('--s_vocab_portion', type=float, default=0.999,
+                        help='same as s_vocab_portion of TextVocab, only for the printed size')
+    parser.add_argument('--t_vocab_portion', type=float, default=1,
+                        help='same as t_vocab_portion of TextVocab, only for the printed size')
+    parser.add_argument('--output_dir', type=str, default='', help='default ../data/<language>')
+    args = parser.parse_args()
+    print(args)
+    output_dir = args.output_dir if args.output_dir != '' else os.path.join('../data', args.language)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    shards = [os.path.join('../data', args.language, 'counts', '{}.json'.format(t)) for t in args.types]
+    source_dic, target_dic = load_count_shards(shards)
+    if args.uni_vocab:
+        # UniTextVocab cuts the merged source and target counts
+        uni_vocab = cut_vocab(source_dic + target_dic, min_freq=args.vocab_threshold)
+        print('uni_vocab:{}/{}'.format(len(uni_vocab), len(source_dic + target_dic)))
+    else:
+        source_vocab = cut_vocab(source_dic, portion=args.s_vocab_portion)
+        target_vocab = cut_vocab(target_dic, portion=args.t_vocab_portion)
+        print('source_vocab:{}/{}'.format(len(source_vocab), len(source_dic)))
+        print('target_vocab:{}/{}'.format(len(target_vocab), len(target_dic)))
+    with open(os.path.join(output_dir, 'source_vocab.json'), 'w') as f:
+        json.dump(dict(source_dic), f)
+    with open(os.path.join(output_dir, 'target_vocab.json'), 'w') as f:
+        json.dump(dict(target_dic), f)
@@ -0,0 +1,39 @@
+from argparse import Namespace
+import torch
+from dataset.dataset import collect_fn, to_tensor
+from dataset.process_utils import path_process, r_path_process
+from model.embedding import PathEmbedding
+
+PATH_EMBEDDING_NUM = 120
+
+
+def one_token_sample():
+    # a snippet of one token has no relative path and one absolute path
+    paths_map, paths, paths_mask = path_process([], [], 64, 1, PATH_EMBEDDING_NUM, 32)
+    r_paths, r_path_idx, r_paths_mask = r_path_process([[5, 3, 7]], [0], 64, 1, 32, PATH_EMBEDDING_NUM)
+    sample = {'f_source': [3, 4], 'f_target': [4, 2], 'content': [5], 'content_mask': [1], 'named': [0],
+              'row': [1], 'paths': paths, 'paths_mask': paths_mask, 'path_map': paths_map, 'r_paths': r_paths,
+              'r_paths_mask': r_paths_mask, 'r_path_idx': r_path_idx, 'target': 0}
+    return {key: to_tensor(value) for key, value in sample.items()}
+
+
+def path_args(**kwargs):
+    args = dict(ap_split=False, path_embedding_num=PATH_EMBEDDING_NUM, path_embedding_size=8, gru_size=8,
+                gru_layers=1, bidirectional=True, relation_path=True, absolute_path=True, gru_ln=False,
+                packed_path_gru=True, ap_trie=False, path_dedup=True, paths_once=False, path_table=0,
+                path_table_file='')
+    args.update(kwargs)
+    return Namespace(**args)
+
+
+def test_one_token_batch():
+    batch = [one_token_sample() for _ in range(3)]
+    data = collect_fn(batch, path_padding_idx=PATH_EMBEDDING_NUM)
+    # one forward/backward padding pair, and the pair map points at the padding path after it
+    assert data['paths'].shape[1] == 2
+    assert torch.all(data['path_map'] == 2)
+    embedding = PathEmbedding(path_args())
+    paths_ = embedding(data['paths'], data['paths_mask'], type='relation')
+    assert paths_.shape[:2] == (3, 2)
+    r_paths_ = embedding(data['r_paths'], data['r_paths_mask'], type='absolute')
+    assert r_paths_.shape[:2] == (3, 1)
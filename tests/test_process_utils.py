@@ -0,0 +1,20 @@
+import numpy as np
+from dataset.process_utils import bidirectional_paths
+
+PATH_EMBEDDING_NUM = 120
+
+
+def test_paths_once_matches_both_directions():
+    # paths shorter than, equal to, up to twice and beyond twice max_length
+    paths = [list(range(n)) for n in [2, 4, 6, 9, 13]]
+    max_length = 4
+    both, both_mask = bidirectional_paths(paths, 8, max_length, PATH_EMBEDDING_NUM)
+    once, once_mask = bidirectional_paths(paths, 8, max_length, PATH_EMBEDDING_NUM, once=True)
+    for i, (row, stored) in enumerate(zip(once, once_mask)):
+        length = min(stored, max_length)
+        # as PathEmbedding.reverse_rnn reads the stored row
+        forward = row[:length]
+        backward = row[stored - 1 - np.arange(length)]
+        assert both_mask[2 * i] == both_mask[2 * i + 1] == length
+        assert forward.tolist() == both[2 * i, :length].tolist()
+        assert backward.tolist() == both[2 * i + 1, :length].tolist()
@@ -38,7 +38,7 @@ class Trainer:
         self.iter = -1
         self.t_vocab = t_vocab
         self.best_epoch, self.best_f1 = 0, float('-inf')
-        self.accu_steps = self.args.accu_batch_size // self.args.batch_size
+        self.accu_batch_size = self.args.accu_batch_size  # batches may differ in size, so count samples
         self.criterion = nn.NLLLoss(ignore_index=0)
         self.unk_shift = self.args.unk_shift
         if self.args.relation_path or self.args.absolute_path:
@@ -114,6 +114,18 @@ class Trainer:
             return loss.sum()
         return loss
 
+    def accu_step(self, accu_samples):
+        '''
+        the losses are scaled by the batch size over accu_batch_size, so the grads are rescaled to the mean
+        over the accu_samples actually accumulated, which differ from accu_batch_size with varying batch sizes
+        '''
+        if accu_samples != self.accu_batch_size:
+            for param in self.model.parameters():
+                if param.grad is not None:
+                    param.grad.mul_(self.accu_batch_size / accu_samples)
+        self.optim.step()
+        self.optim.zero_grad()
+
     def iteration(self, epoch, data_loader, train=True):
         str_code = "train" if train else "valid"
         data_iter = tqdm(enumerate(data_loader),
@@ -123,6 +135,7 @@ class Trainer:
         avg_loss = 0.0
         if train:
             self.optim.zero_grad()
+            accu_samples = 0
         for i, data in data_iter:
             data = {key: value.to(self.device) if torch.is_tensor(value) else value for key, value in data.items()}
             if train:
@@ -132,13 +145,14 @@ class Trainer:
                 labels = data['target']
                 loss_fct = torch.nn.CrossEntropyLoss()
                 loss = loss_fct(out, labels)
-                accu_loss = loss / self.accu_steps
+                accu_loss = loss * labels.shape[0] / self.accu_batch_size
                 accu_loss.backward()
                 if self.clip > 0:
                     torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.clip)
-                if (i + 1) % self.accu_steps == 0:
-                    self.optim.step()
-                    self.optim.zero_grad()
+                accu_samples += labels.shape[0]
+                if accu_samples >= self.accu_batch_size:
+                    self.accu_step(accu_samples)
+                    accu_samples = 0
             else:
                 self.model.eval()
                 with torch.no_grad():
@@ -159,6 +173,9 @@ class Trainer:
                 self.iter += 1
                 if self.tensorboard_writer is not None:
                     self.tensorboard_writer.add_scalar('Loss', post_fix['Iter loss'], self.iter)
+        if train and accu_samples > 0:
+            # the partial accumulation at the end of the epoch is still a step
+            self.accu_step(accu_samples)
         avg_loss = avg_loss / len(data_iter)
         print("EP%d_%s, avg_loss=" % (epoch, str_code), avg_loss, file=self.writer, flush=True)
         print('-------------------------------------', file=self.writer, flush=True)
@@ -251,4 +268,8 @@ class Trainer:
                 self.best_epoch = epoch
             print("Best Valid At EP{}, best_f1={}".format(self.best_epoch, self.best_f1), file=self.writer,
                   flush=True)
+        if test and self.args.path_table > 0 and self.args.path_table_file:
+            model = self.model.module if isinstance(self.model, nn.DataParallel) else self.model
+            if hasattr(model, 'path_embedding'):
+                model.path_embedding.save_tables(self.args.path_table_file)
         print('-------------------------------------', file=self.writer, flush=True)